@@ -0,0 +1,213 @@
+"""
+Pre-aggregated order totals for admin dashboards.
+
+OrderStat keeps order count, paid order count, revenue (total_amount) and
+paid revenue per (day, status, courier), the day being the order's creation
+date. Changes are appended, never applied in place: moving an order from
+one bucket to another writes a -1 row for the old bucket and a +1 row for
+the new one. Concurrent order writes therefore never wait on a shared
+counter row, and the deltas commit or roll back with the order itself.
+
+Single orders are recorded by signal handlers on save and delete. Bulk
+writers (import, bulk assign and transition, dispatch, Stripe webhooks)
+change rows through querysets or raw SQL, which send no signals, so they
+call ``record_changes()`` themselves.
+
+The compact_order_stats command folds the appended rows into one row per
+bucket, which keeps a dashboard read at O(days x statuses x couriers) rows.
+``rebuild()`` recomputes days from the order and archive tables instead,
+to repair totals after writes that bypassed both paths (raw SQL, manual
+fixes). Orders moved to the archive keep counting (see courier_app.archive).
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderStat
+
+# Order fields that decide an order's bucket and what it adds to it
+ROLLUP_FIELDS = ('created_at', 'status', 'delivery_man_id', 'total_amount', 'is_paid')
+
+MEASURES = ('orders', 'paid_orders', 'revenue', 'paid_revenue')
+
+# Courier statuses counted as delivered
+DELIVERED_STATUSES = (Order.StatusChoices.DELIVERED, Order.StatusChoices.COMPLETE)
+
+# Widest date range one dashboard request may read
+MAX_DAYS = 366
+
+ZERO = Decimal('0.00')
+
+
+def rollup_values(order):
+    """The ROLLUP_FIELDS of an Order instance."""
+    return {field: getattr(order, field) for field in ROLLUP_FIELDS}
+
+
+def stored_values(order):
+    """
+    The ROLLUP_FIELDS of ``order`` as last loaded or saved; fields that were
+    not loaded cannot have changed.
+    """
+    loaded = getattr(order, '_loaded_values', {})
+    return {field: loaded[field] if field in loaded else getattr(order, field) for field in ROLLUP_FIELDS}
+
+
+def bucket(values):
+    """(bucket key, measures) an order with ``values`` contributes."""
+    amount = values['total_amount'] or ZERO
+    paid = bool(values['is_paid'])
+    key = (timezone.localdate(values['created_at']), values['status'], values['delivery_man_id'])
+    return key, (1, int(paid), amount, amount if paid else ZERO)
+
+
+def record_changes(changes):
+    """
+    Append the deltas for ``changes``, pairs of (before, after) ROLLUP_FIELDS
+    mappings; before is None for a new order, after for a removed one.
+    Changes that cancel out within a bucket write nothing.
+    """
+    totals = defaultdict(lambda: [0, 0, ZERO, ZERO])
+    for before, after in changes:
+        for values, sign in ((before, -1), (after, 1)):
+            if values is None:
+                continue
+            key, measures = bucket(values)
+            total = totals[key]
+            for index, measure in enumerate(measures):
+                total[index] += sign * measure
+    OrderStat.objects.bulk_create(
+        OrderStat(day=day, status=status, courier_id=courier_id, **dict(zip(MEASURES, total)))
+        for (day, status, courier_id), total in totals.items()
+        if any(total)
+    )
+
+
+def compact(since=None):
+    """
+    Fold the rows of every bucket holding more than one into a single row,
+    dropping buckets that add up to nothing. Returns (rows removed, rows written).
+    """
+    stats = OrderStat.objects.all() if since is None else OrderStat.objects.filter(day__gte=since)
+    days = set(
+        stats.values('day', 'status', 'courier_id').annotate(rows=Count('id')).filter(rows__gt=1)
+        .values_list('day', flat=True)
+    )
+    removed = written = 0
+    for day in sorted(days):
+        with transaction.atomic():
+            # Rows appended from here on are left for the next run
+            rows = OrderStat.objects.filter(day=day).select_for_update().values_list(
+                'id', 'status', 'courier_id', *MEASURES
+            )
+            ids, totals = defaultdict(list), defaultdict(lambda: [0, 0, ZERO, ZERO])
+            for row_id, status, courier_id, *measures in rows:
+                ids[status, courier_id].append(row_id)
+                total = totals[status, courier_id]
+                for index, measure in enumerate(measures):
+                    total[index] += measure
+            stale = [
+                key for key, key_ids in ids.items() if len(key_ids) > 1 or not any(totals[key])
+            ]
+            stale_ids = [row_id for key in stale for row_id in ids[key]]
+            OrderStat.objects.filter(id__in=stale_ids).delete()
+            fresh = OrderStat.objects.bulk_create(
+                OrderStat(day=day, status=status, courier_id=courier_id, **dict(zip(MEASURES, totals[status, courier_id])))
+                for status, courier_id in stale
+                if any(totals[status, courier_id])
+            )
+        removed += len(stale_ids)
+        written += len(fresh)
+    return removed, written
+
+
+def rebuild(since=None):
+    """
+    Recompute the totals of orders created on or after ``since`` (all if
+    None) from the order and archive tables. Deltas recorded while it runs
+    may be counted twice, so run it while orders are not being written.
+    Returns the rows written.
+    """
+    stats = OrderStat.objects.all() if since is None else OrderStat.objects.filter(day__gte=since)
+    zero = Value(ZERO, output_field=DecimalField(max_digits=14, decimal_places=2))
+    paid = Q(is_paid=True)
+    totals = defaultdict(lambda: [0, 0, ZERO, ZERO])
+    for model in (Order, ArchivedOrder):
+        orders = model.objects.all() if since is None else model.objects.filter(created_at__date__gte=since)
+        rows = (
+            orders.annotate(day=TruncDate('created_at'))
+            .values_list('day', 'status', 'delivery_man_id')
+            .annotate(
+                orders=Count('id'),
+                paid_orders=Count('id', filter=paid),
+                revenue=Coalesce(Sum('total_amount'), zero),
+                paid_revenue=Coalesce(Sum('total_amount', filter=paid), zero),
+            )
+            .order_by()
+        )
+        for day, status, courier_id, *measures in rows:
+            total = totals[day, status, courier_id]
+            for index, measure in enumerate(measures):
+                total[index] += measure
+
+    with transaction.atomic():
+        stats.delete()
+        return len(OrderStat.objects.bulk_create(
+            (
+                OrderStat(day=day, status=status, courier_id=courier_id, **dict(zip(MEASURES, total)))
+                for (day, status, courier_id), total in totals.items()
+            ),
+            batch_size=1000,
+        ))
+
+
+def default_range():
+    """The last 30 days, today included."""
+    today = timezone.localdate()
+    return today - timedelta(days=29), today
+
+
+def order_summary(start, end):
+    """Totals per day and per courier for orders created from ``start`` to ``end`` inclusive."""
+    stats = OrderStat.objects.filter(day__range=(start, end))
+    sums = {measure: Sum(measure) for measure in MEASURES}
+
+    totals = {'orders': 0, 'paid_orders': 0, 'revenue': ZERO, 'paid_revenue': ZERO, 'by_status': {}}
+    days = {}
+    for row in stats.values('day', 'status').annotate(**sums).order_by('day', 'status'):
+        if not row['orders']:
+            continue
+        day = days.setdefault(row['day'], {'day': row['day'], **{measure: 0 for measure in MEASURES}, 'by_status': {}})
+        for entry in (day, totals):
+            for measure in MEASURES:
+                entry[measure] += row[measure]
+            entry['by_status'][row['status']] = entry['by_status'].get(row['status'], 0) + row['orders']
+
+    couriers = {}
+    rows = stats.filter(courier_id__isnull=False).values('courier_id', 'status').annotate(orders=Sum('orders'))
+    for row in rows.order_by('courier_id', 'status'):
+        if not row['orders']:
+            continue
+        courier = couriers.setdefault(
+            row['courier_id'], {'delivery_man_id': row['courier_id'], 'orders': 0, 'delivered': 0, 'by_status': {}}
+        )
+        courier['orders'] += row['orders']
+        courier['by_status'][row['status']] = row['orders']
+        if row['status'] in DELIVERED_STATUSES:
+            courier['delivered'] += row['orders']
+
+    for entry in (totals, *days.values()):
+        # Money as strings, like the order serializers render it
+        entry['revenue'], entry['paid_revenue'] = str(entry['revenue']), str(entry['paid_revenue'])
+    return {
+        'start': start,
+        'end': end,
+        'totals': totals,
+        'days': list(days.values()),
+        'couriers': sorted(couriers.values(), key=lambda courier: -courier['delivered']),
+    }
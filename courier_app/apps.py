@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class CourierAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "courier_app"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        from django.conf import settings
+        if settings.METRICS_ENABLED:
+            from . import metrics
+            metrics.install()
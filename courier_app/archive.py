@@ -0,0 +1,119 @@
+"""
+Archival of finished orders.
+
+COMPLETE and RETURNED orders that have not changed for
+ORDER_ARCHIVE_AFTER_DAYS move from Order to ArchivedOrder, so the hot table
+and its indexes only hold orders that can still change. Each batch of
+ORDER_ARCHIVE_BATCH_SIZE orders is copied, with its status events and
+payment jobs rendered to JSON, and deleted in one transaction; batches locked by another run are
+skipped on databases that support SKIP LOCKED.
+
+Archived orders still count in the analytics totals and are still served
+by the order detail and history endpoints (see OrderViewSet.retrieve).
+"""
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderStatusEvent, PaymentJob
+from .response_cache import invalidate_orders
+from .serializers import OrderStatusEventSerializer
+
+ARCHIVED_STATUSES = (Order.StatusChoices.COMPLETE, Order.StatusChoices.RETURNED)
+
+# Columns copied as they are; ArchivedOrder declares the same ones
+COPIED_COLUMNS = [field.column for field in Order._meta.concrete_fields]
+
+# PaymentJob columns kept for the payment audit trail; the client secret is
+# useless once the order is finished and is not kept
+ARCHIVED_PAYMENT_JOB_FIELDS = ('id', 'status', 'attempts', 'last_error', 'run_after', 'created_at', 'updated_at')
+
+# True while orders are deleted because they moved to the archive, which is
+# not a cancellation: signal handlers leave the analytics totals alone
+archiving = ContextVar('archiving', default=False)
+
+
+def archive_batch(before, batch_size):
+    """Move up to ``batch_size`` archivable orders. Returns how many moved."""
+    with transaction.atomic():
+        orders = list(
+            Order.objects.filter(status__in=ARCHIVED_STATUSES, updated_at__lt=before)
+            .order_by('id')
+            .select_for_update(skip_locked=True)
+            .values_list('id', 'user_id', 'delivery_man_id')[:batch_size]
+        )
+        if not orders:
+            return 0
+        ids = [order_id for order_id, _, _ in orders]
+
+        # Copy the rows inside the database rather than through model instances
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(column) for column in COPIED_COLUMNS)
+        history_field = ArchivedOrder._meta.get_field('status_history')
+        jobs_field = ArchivedOrder._meta.get_field('payment_jobs')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(ArchivedOrder._meta.db_table)} ({columns}, {quote('status_history')}, "
+                f"{quote('payment_jobs')}, {quote('archived_at')}) SELECT {columns}, %s, %s, %s "
+                f"FROM {quote(Order._meta.db_table)} WHERE {quote('id')} IN ({', '.join(['%s'] * len(ids))})",
+                [
+                    history_field.get_db_prep_save([], connection),
+                    jobs_field.get_db_prep_save([], connection),
+                    connection.ops.adapt_datetimefield_value(timezone.now()),
+                    *ids,
+                ],
+            )
+            events = list(
+                OrderStatusEvent.objects.filter(order_id__in=ids).select_related('changed_by').order_by('created_at', 'id')
+            )
+            history = defaultdict(list)
+            # One serializer for all events: DRF builds its fields per serializer instance
+            for event, data in zip(events, OrderStatusEventSerializer(events, many=True).data):
+                history[event.order_id].append(data)
+            payment_jobs = defaultdict(list)
+            jobs = PaymentJob.objects.filter(order_id__in=ids).order_by('created_at', 'id')
+            for job in jobs.values('order_id', *ARCHIVED_PAYMENT_JOB_FIELDS):
+                payment_jobs[job.pop('order_id')].append(job)
+            cursor.executemany(
+                f"UPDATE {quote(ArchivedOrder._meta.db_table)} SET {quote('status_history')} = %s, "
+                f"{quote('payment_jobs')} = %s WHERE {quote('id')} = %s",
+                [
+                    (
+                        history_field.get_db_prep_save(history[order_id], connection),
+                        jobs_field.get_db_prep_save(payment_jobs[order_id], connection),
+                        order_id,
+                    )
+                    for order_id in history.keys() | payment_jobs.keys()
+                ],
+            )
+
+        token = archiving.set(True)
+        try:
+            # Status events and payment jobs, now copied, go with the orders (CASCADE)
+            Order.objects.filter(id__in=ids).delete()
+        finally:
+            archiving.reset(token)
+        invalidate_orders((user_id, delivery_man_id) for _, user_id, delivery_man_id in orders)
+    return len(orders)
+
+
+def archive_orders(before=None, batch_size=None, max_batches=None):
+    """
+    Archive finished orders last changed before ``before`` (default:
+    ORDER_ARCHIVE_AFTER_DAYS ago), batch by batch. Returns how many moved.
+    """
+    if before is None:
+        before = timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(before, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+    return moved
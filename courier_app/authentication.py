@@ -0,0 +1,120 @@
+"""
+JWT authentication that trusts the token for read requests.
+
+Access tokens carry the user's ``role`` and ``token_version`` (see
+CustomTokenObtainPairSerializer). For safe methods the user is rebuilt from
+those claims without touching the database; any other field is loaded lazily
+if a view asks for it. Write requests, tokens without the claims and tokens
+whose version differs from the cached current one go through the regular
+database lookup, which rejects revoked versions. Cached versions expire
+after TOKEN_VERSION_CACHE_TTL and are reloaded from the database; with a
+TTL of 0 (the default without a shared cache) every request loads the user.
+Every token is also checked against the revocation list (see
+courier_app.revocation).
+
+StreamToken is a short-lived token that only opens the order event stream,
+so the access token itself never has to appear in a URL.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import permissions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken, Token
+
+from .models import User
+from .revocation import REFRESH_JTI_CLAIM, revocation_list, session_jti
+
+ROLE_CLAIM = 'role'
+VERSION_CLAIM = 'ver'
+
+
+def version_key(user_id):
+    return f"token_version:{user_id}"
+
+
+def remember_token_version(user):
+    if settings.TOKEN_VERSION_CACHE_TTL:
+        cache.set(version_key(user.pk), user.token_version, timeout=settings.TOKEN_VERSION_CACHE_TTL)
+
+
+def user_from_claims(token):
+    """A User with only id, role, is_active and token_version loaded; other fields load on access."""
+    loaded = {
+        'id': token[jwt_settings.USER_ID_CLAIM],
+        'role': token[ROLE_CLAIM],
+        'is_active': True,
+        'token_version': token[VERSION_CLAIM],
+    }
+    # from_db expects the values in field order
+    fields = [field.attname for field in User._meta.concrete_fields if field.attname in loaded]
+    return User.from_db('default', fields, [loaded[field] for field in fields])
+
+
+class SessionRefreshToken(RefreshToken):
+    """Refresh token whose access tokens remember it, so blacklisting it revokes them too."""
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        access[REFRESH_JTI_CLAIM] = self[jwt_settings.JTI_CLAIM]
+        return access
+
+
+class StreamToken(Token):
+    """Opens the order event stream (views.order_events) and nothing else."""
+
+    token_type = 'stream'
+    lifetime = timedelta(seconds=settings.ORDER_EVENTS_TOKEN_SECONDS)
+
+    @classmethod
+    def for_access_token(cls, access):
+        """A stream token for the user and session of ``access``, revoked with it."""
+        token = cls()
+        token[jwt_settings.USER_ID_CLAIM] = access[jwt_settings.USER_ID_CLAIM]
+        token[REFRESH_JTI_CLAIM] = session_jti(access)
+        return token
+
+    @classmethod
+    def validate(cls, raw_token):
+        token = cls(raw_token)
+        if revocation_list.is_revoked(session_jti(token)):
+            raise InvalidToken({"detail": _("Token has been revoked"), "code": "token_revoked"})
+        return token
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = self.get_validated_token(raw_token)
+
+        if request.method in permissions.SAFE_METHODS and self.claims_are_current(token):
+            return user_from_claims(token), token
+        return self.get_user(token), token
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if revocation_list.is_revoked(session_jti(token)):
+            raise InvalidToken({"detail": _("Token has been revoked"), "code": "token_revoked"})
+        return token
+
+    def claims_are_current(self, token):
+        if not settings.TOKEN_VERSION_CACHE_TTL or ROLE_CLAIM not in token or VERSION_CLAIM not in token:
+            return False
+        return cache.get(version_key(token[jwt_settings.USER_ID_CLAIM])) == token[VERSION_CLAIM]
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if VERSION_CLAIM in validated_token and validated_token[VERSION_CLAIM] != user.token_version:
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        remember_token_version(user)
+        return user
@@ -0,0 +1,65 @@
+"""
+Conditional GET (ETag / Last-Modified) for order endpoints.
+
+Validators come from ``Order.updated_at``: the row's own value for a single
+order, ``max(updated_at)`` plus the row count for a collection. A client
+sending a matching ``If-None-Match`` (or, for a single order,
+``If-Modified-Since``) gets an empty 304 before anything is serialized.
+
+Collections only get an ETag: ``max(updated_at)`` does not move when an order
+is deleted, archived or reassigned away, so a date alone would answer 304 for
+a list that changed. The count in the ETag catches those.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def _etag(request, *parts):
+    # The caller and the query string (cursor, page size) shape the body too
+    key = '|'.join(str(part) for part in (request.user.pk, request.get_full_path(), *parts))
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def collection_validators(request, queryset):
+    """One aggregate query: (etag, None) for everything in ``queryset``; no Last-Modified."""
+    summary = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('id'))
+    last_modified = summary['last_modified']
+    return _etag(request, summary['count'], last_modified.isoformat() if last_modified else ''), None
+
+
+def object_validators(request, order):
+    return _etag(request, order.pk, order.updated_at.isoformat()), order.updated_at
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        # If-None-Match wins over If-Modified-Since (RFC 9110, 13.2.2)
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags or etag.removeprefix('W/') in etags
+
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    if if_modified_since is not None and last_modified is not None:
+        return int(last_modified.timestamp()) <= if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Per-user data: browsers may keep it but must revalidate each time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def conditional(request, validators, build_response):
+    """Return 304 when the client's copy is current, otherwise ``build_response()``."""
+    etag, last_modified = validators
+    if is_not_modified(request, etag, last_modified):
+        return with_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+    return with_validators(build_response(), etag, last_modified)
@@ -0,0 +1,253 @@
+"""
+Automatic assignment of pending orders to delivery men.
+
+A dispatch run:
+
+1. loads unassigned PENDING orders and geocodes pickups that have no
+   coordinates yet (one ``geocode_many`` call, one batched UPDATE); orders
+   that cannot be located are left pending;
+2. loads available couriers with a location reported in the last
+   DISPATCH_LOCATION_MAX_AGE seconds and their free capacity
+   (DISPATCH_COURIER_CAPACITY minus the orders they still carry);
+3. matches orders to couriers in rounds over the order x courier distance
+   matrix: every order proposes to its nearest courier with capacity left,
+   each courier accepts its closest proposals up to that capacity, and the
+   rest propose again. Pairs further apart than DISPATCH_MAX_DISTANCE_KM are
+   never matched;
+4. locks and re-reads the matched orders, then writes all assignments with
+   one prepared UPDATE, skipping orders assigned or moved on by someone
+   else in the meantime. The analytics deltas start from the re-read rows.
+
+Matching is vectorized with NumPy when it is installed.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .analytics import ROLLUP_FIELDS, record_changes
+from .geo import distance_matrix, geohash, neighbours, np
+from .geocoding import geocode_many
+from .models import CourierLocation, Order, User
+from .realtime import publish_order_change
+from .response_cache import invalidate_orders
+
+# Orders a courier is still carrying
+ACTIVE_STATUSES = (Order.StatusChoices.PENDING, Order.StatusChoices.PICKED, Order.StatusChoices.IN_TRANSIT)
+
+
+def geocode_orders(orders, point='pickup'):
+    """
+    Fill in missing ``point`` ('pickup' or 'delivery') coordinates of
+    ``orders`` (dicts from values()) in place and store them. Stored rows get
+    a new ``updated_at`` (also set on the dicts that carry one) and their
+    cached responses are dropped, like any other write to an order.
+    """
+    lat, lng, address = f'{point}_lat', f'{point}_lng', f'{point}_address'
+    missing = [order for order in orders if order[lat] is None]
+    if not missing:
+        return
+    points = geocode_many(order[address] for order in missing)
+    columns = [lat, lng, 'pickup_geohash', 'updated_at'] if point == 'pickup' else [lat, lng, 'updated_at']
+    now = timezone.now()
+    stamp = connection.ops.adapt_datetimefield_value(now)
+    located = []
+    for order in missing:
+        location = points.get(order[address])
+        if location is not None:
+            order[lat], order[lng] = location
+            if 'updated_at' in order:
+                order['updated_at'] = now
+            extra = (geohash(*location),) if point == 'pickup' else ()
+            located.append((*location, *extra, stamp, order['id']))
+    if not located:
+        return
+
+    # One prepared statement for all rows; bulk_update's CASE per row is
+    # quadratic in the batch size
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f"{quote(column)} = %s" for column in columns)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {quote(Order._meta.db_table)} SET {assignments} WHERE {quote('id')} = %s", located
+            )
+        invalidate_orders(
+            Order.objects.filter(id__in=[row[-1] for row in located]).values_list('user_id', 'delivery_man_id')
+        )
+
+
+def current_locations():
+    """Locations of available couriers, reported recently enough to trust."""
+    locations = CourierLocation.objects.filter(is_available=True)
+    if settings.DISPATCH_LOCATION_MAX_AGE:
+        cutoff = timezone.now() - timedelta(seconds=settings.DISPATCH_LOCATION_MAX_AGE)
+        locations = locations.filter(updated_at__gte=cutoff)
+    return locations
+
+
+def available_couriers():
+    """[(courier_id, lat, lng, free_capacity)] for couriers that can take orders."""
+    active = Q(courier__assigned_orders__status__in=ACTIVE_STATUSES)
+    rows = (
+        current_locations().filter(courier__role=User.Roles.DELIVERY_MAN, courier__is_active=True)
+        .annotate(load=Count('courier__assigned_orders', filter=active))
+        .values_list('courier_id', 'lat', 'lng', 'load')
+    )
+    capacity = settings.DISPATCH_COURIER_CAPACITY
+    return [(courier_id, lat, lng, capacity - load) for courier_id, lat, lng, load in rows if load < capacity]
+
+
+def match(order_points, courier_points, capacities, max_km):
+    """
+    Match orders to couriers. Returns {order index: (courier index, km)}.
+    ``capacities`` is the number of orders each courier can still take.
+    """
+    if not order_points or not courier_points:
+        return {}
+    distances = distance_matrix(order_points, courier_points)
+    if np is None:
+        return _match_python(distances, list(capacities), max_km)
+
+    distances = np.where(distances <= max_km, distances, np.inf)
+    remaining = np.asarray(capacities, dtype=np.int64)
+    open_orders = np.arange(len(order_points))
+    matched = {}
+    while open_orders.size and remaining.any():
+        candidates = distances[open_orders]
+        candidates[:, remaining <= 0] = np.inf
+        nearest = candidates.argmin(axis=1)
+        km = candidates[np.arange(open_orders.size), nearest]
+        reachable = np.isfinite(km)
+        if not reachable.any():
+            break
+        proposers, couriers, km = open_orders[reachable], nearest[reachable], km[reachable]
+
+        # Rank each courier's proposals by distance, accept up to its capacity
+        by_courier = np.lexsort((km, couriers))
+        proposers, couriers, km = proposers[by_courier], couriers[by_courier], km[by_courier]
+        group_starts = np.flatnonzero(np.r_[True, couriers[1:] != couriers[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, couriers.size])
+        rank = np.arange(couriers.size) - np.repeat(group_starts, group_sizes)
+        accepted = rank < remaining[couriers]
+
+        for order, courier, distance in zip(proposers[accepted], couriers[accepted], km[accepted]):
+            matched[int(order)] = (int(courier), float(distance))
+        remaining -= np.bincount(couriers[accepted], minlength=remaining.size)
+        open_orders = np.setdiff1d(open_orders, proposers[accepted], assume_unique=True)
+    return matched
+
+
+def _match_python(distances, remaining, max_km):
+    open_orders = list(range(len(distances)))
+    matched = {}
+    while open_orders:
+        proposals = defaultdict(list)
+        for order in open_orders:
+            options = [
+                (km, courier) for courier, km in enumerate(distances[order]) if remaining[courier] > 0 and km <= max_km
+            ]
+            if options:
+                km, courier = min(options)
+                proposals[courier].append((km, order))
+        if not proposals:
+            break
+        for courier, offers in proposals.items():
+            for km, order in sorted(offers)[:remaining[courier]]:
+                matched[order] = (courier, km)
+            remaining[courier] -= min(remaining[courier], len(offers))
+        open_orders = [order for order in open_orders if order not in matched]
+    return matched
+
+
+def assign(by_courier):
+    """
+    Write {courier_id: [(order, km)]} in one prepared UPDATE, only where the
+    order is still unassigned and PENDING. Returns the ids of the orders
+    assigned.
+    """
+    ids = [order['id'] for batch in by_courier.values() for order, _ in batch]
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    quote = connection.ops.quote_name
+    with transaction.atomic():
+        # Locked and re-read, so the rollup deltas start from the rows the
+        # UPDATE changes rather than from the unlocked read of the run
+        current = {
+            order['id']: order
+            for order in Order.objects.filter(
+                id__in=ids, status=Order.StatusChoices.PENDING, delivery_man__isnull=True
+            ).select_for_update().values('id', *ROLLUP_FIELDS)
+        }
+        rows = [
+            (courier_id, now, order['id'], Order.StatusChoices.PENDING)
+            for courier_id, batch in by_courier.items()
+            for order, _ in batch
+            if order['id'] in current
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {quote(Order._meta.db_table)} SET {quote('delivery_man_id')} = %s, {quote('updated_at')} = %s "
+                f"WHERE {quote('id')} = %s AND {quote('delivery_man_id')} IS NULL AND {quote('status')} = %s",
+                rows,
+            )
+        record_changes(
+            (current[order_id], {**current[order_id], 'delivery_man_id': courier_id})
+            for courier_id, _, order_id, _ in rows
+        )
+    return set(current)
+
+
+def dispatch_pending_orders(limit=None):
+    """Assign unassigned pending orders to nearby couriers, oldest first. Returns a summary."""
+    pending = Order.objects.filter(status=Order.StatusChoices.PENDING, delivery_man__isnull=True)
+    orders = list(
+        pending.order_by('created_at').values('id', 'user_id', 'pickup_address', 'pickup_lat', 'pickup_lng')[:limit]
+    )
+    geocode_orders(orders)
+    orders = [order for order in orders if order['pickup_lat'] is not None]
+    couriers = available_couriers()
+
+    matched = match(
+        [(order['pickup_lat'], order['pickup_lng']) for order in orders],
+        [(lat, lng) for _, lat, lng, _ in couriers],
+        [capacity for *_, capacity in couriers],
+        settings.DISPATCH_MAX_DISTANCE_KM,
+    )
+    by_courier = defaultdict(list)
+    for order_index, (courier_index, km) in matched.items():
+        by_courier[couriers[courier_index][0]].append((orders[order_index], km))
+    assigned = assign(by_courier) if matched else set()
+
+    assignments, parties = [], []
+    for courier_id, batch in by_courier.items():
+        for order, km in batch:
+            # Orders assigned by hand or moved on since they were read are left alone
+            if order['id'] not in assigned:
+                continue
+            assignments.append({'id': order['id'], 'delivery_man_id': courier_id, 'distance_km': round(km, 3)})
+            parties.append((order['user_id'], courier_id))
+            publish_order_change(order['id'], Order.StatusChoices.PENDING, order['user_id'], courier_id, event='assigned')
+    invalidate_orders(parties)
+
+    return {
+        'assigned': len(assignments),
+        'unassigned': pending.count(),
+        'couriers': len(couriers),
+        'assignments': assignments,
+    }
+
+
+def couriers_near(lat, lng, limit=10):
+    """Available couriers in the point's geohash cell and the eight around it, nearest first."""
+    locations = list(
+        current_locations().filter(geohash__in=neighbours(geohash(lat, lng)))
+        .values_list('courier_id', 'lat', 'lng')
+    )
+    if not locations:
+        return []
+    distances = distance_matrix([(lat, lng)], [(courier_lat, courier_lng) for _, courier_lat, courier_lng in locations])[0]
+    nearby = sorted(zip((float(km) for km in distances), (courier_id for courier_id, *_ in locations)))
+    return [{'delivery_man_id': courier_id, 'distance_km': round(km, 3)} for km, courier_id in nearby[:limit]]
@@ -0,0 +1,98 @@
+"""
+Geohash cells and great-circle distances.
+
+Pickup points and courier positions are stored with a geohash so "who is
+near this cell" is an indexed prefix lookup. Distances use the haversine
+formula; ``distance_matrix`` is vectorized with NumPy when it is installed.
+"""
+import math
+
+try:
+    import numpy as np
+except ImportError:  # optional, see distance_matrix()
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Stored precision: cells of about 4.9 x 4.9 km at the equator; a cell and its
+# eight neighbours cover at least one cell width around any point inside it
+GEOHASH_PRECISION = 5
+
+
+def geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) of a cell in degrees."""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 - lng_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def decode(cell):
+    """Centre (lat, lng) of a cell."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
+def neighbours(cell):
+    """The cell and the eight cells around it."""
+    lat, lng = decode(cell)
+    height, width = cell_size(len(cell))
+    return {
+        geohash(max(-90.0, min(90.0, lat + dy * height)), (lng + dx * width + 180.0) % 360.0 - 180.0, len(cell))
+        for dy in (-1, 0, 1)
+        for dx in (-1, 0, 1)
+    }
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def distance_matrix(origins, destinations):
+    """
+    Kilometres from every (lat, lng) in ``origins`` to every one in
+    ``destinations``: a NumPy array if NumPy is available, else nested lists.
+    """
+    if np is None:
+        return [[haversine_km(*origin, *destination) for destination in destinations] for origin in origins]
+
+    a = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    b = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    lat1, lng1 = a[:, 0:1], a[:, 1:2]
+    lat2, lng2 = b[:, 0], b[:, 1]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, h)))
@@ -0,0 +1,69 @@
+"""
+Address geocoding for dispatch.
+
+Addresses written as "lat,lng" are read as coordinates. Any other address
+needs a geocoder, configured through GEOCODER: any class with a
+``geocode_many(addresses)`` method returning ``{address: (lat, lng) or None}``,
+e.g. one wrapping the deployment's geocoding provider. Without one such
+orders stay unlocated: dispatch skips them and routes report them unrouted.
+
+OfflineGeocoder invents points and exists for tests and demos only.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+COORDINATES = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def parse_coordinates(address):
+    """(lat, lng) for a "lat,lng" address, otherwise None."""
+    match = COORDINATES.match(address)
+    if not match:
+        return None
+    lat, lng = float(match[1]), float(match[2])
+    return (lat, lng) if -90 <= lat <= 90 and -180 <= lng <= 180 else None
+
+
+class OfflineGeocoder:
+    """
+    Stand-in geocoder for tests: any address maps to a stable pseudo-random
+    point inside GEOCODER_BOUNDS. Never use it for real orders.
+    """
+
+    def __init__(self):
+        self.south, self.west, self.north, self.east = settings.GEOCODER_BOUNDS
+
+    def geocode(self, address):
+        digest = hashlib.sha256(address.strip().lower().encode()).digest()
+        y = int.from_bytes(digest[:8], 'big') / 2 ** 64
+        x = int.from_bytes(digest[8:16], 'big') / 2 ** 64
+        return self.south + y * (self.north - self.south), self.west + x * (self.east - self.west)
+
+    def geocode_many(self, addresses):
+        return {address: self.geocode(address) for address in set(addresses)}
+
+
+_geocoders = {}
+
+
+def get_geocoder():
+    """The configured GEOCODER instance, or None when none is configured."""
+    path = settings.GEOCODER
+    if not path:
+        return None
+    if path not in _geocoders:
+        _geocoders[path] = import_string(path)()
+    return _geocoders[path]
+
+
+def geocode_many(addresses):
+    """{address: (lat, lng) or None}, trying "lat,lng" parsing before the geocoder."""
+    points = {address: parse_coordinates(address) for address in set(addresses)}
+    unparsed = [address for address, point in points.items() if point is None]
+    geocoder = get_geocoder()
+    if unparsed and geocoder is not None:
+        points.update(geocoder.geocode_many(unparsed))
+    return points
@@ -0,0 +1,18 @@
+"""
+Argon2 with parameters sized for login latency.
+
+Django's defaults (100 MiB, parallelism 8) are meant for a dedicated box; on a
+small gunicorn worker they cost more per login than PBKDF2. The cost stays
+adjustable from the environment, and raising it later upgrades hashes on the
+next successful login like any other hasher change.
+"""
+import os
+
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    # Keeps the "argon2" algorithm name, so hashes stay interchangeable with Django's
+    time_cost = int(os.getenv("ARGON2_TIME_COST", "2"))
+    memory_cost = int(os.getenv("ARGON2_MEMORY_KIB", "19456"))
+    parallelism = int(os.getenv("ARGON2_PARALLELISM", "1"))
@@ -0,0 +1,101 @@
+"""
+Idempotency-Key support for unsafe endpoints.
+
+A client that retries a POST with the same ``Idempotency-Key`` header gets the
+stored response of the first attempt back instead of running the view again.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .utils import error_response
+
+HEADER = 'Idempotency-Key'
+
+# Responses that mean "try again later" are not worth replaying
+NOT_STORED = {status.HTTP_409_CONFLICT, status.HTTP_429_TOO_MANY_REQUESTS}
+
+
+def request_fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(f"{request.method}\n{request.path}\n{payload}".encode()).hexdigest()
+
+
+def idempotent(view_method):
+    """Decorate an APIView/ViewSet handler to honour the Idempotency-Key header."""
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > 255:
+            return error_response(message=f"{HEADER} must be at most 255 characters.", status_code=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        now = timezone.now()
+        record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is not None and record.expires_at <= now:
+            record.delete()
+            record = None
+
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                return error_response(
+                    message=f"{HEADER} was already used for a different request.",
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.response_status is None:
+                return error_response(
+                    message=f"A request with this {HEADER} is still in progress.",
+                    status_code=status.HTTP_409_CONFLICT,
+                )
+            return Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user,
+                    key=key,
+                    method=request.method,
+                    path=request.path[:255],
+                    fingerprint=fingerprint,
+                    expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+                )
+        except IntegrityError:
+            # A concurrent retry got here first
+            return error_response(
+                message=f"A request with this {HEADER} is still in progress.",
+                status_code=status.HTTP_409_CONFLICT,
+            )
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            # Let the client retry after an unexpected failure
+            record.delete()
+            raise
+
+        if response.status_code >= 500 or response.status_code in NOT_STORED:
+            record.delete()
+        else:
+            record.response_status = response.status_code
+            record.response_body = response.data
+            record.save(update_fields=['response_status', 'response_body'])
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys():
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,60 @@
+"""
+Failed-login throttling.
+
+Failures are counted per username and per client IP with a sliding-window
+counter: two fixed-window counters in the cache, the previous one weighted by
+how much of it still overlaps the window. A login is rejected before any
+password is hashed once either count reaches its limit, so a credential
+stuffing burst costs a cache read per attempt instead of a PBKDF2 run.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+
+def _keys(scope, ident, now):
+    window = int(now // settings.LOGIN_FAILURE_WINDOW)
+    return f"login-failures:{scope}:{ident}:{window}", f"login-failures:{scope}:{ident}:{window - 1}"
+
+
+class LoginThrottle:
+    def __init__(self, request, username):
+        self.now = time.time()
+        self.limits = {
+            'username': (str(username or '').lower(), settings.LOGIN_MAX_FAILURES_PER_USERNAME),
+            'ip': (BaseThrottle().get_ident(request), settings.LOGIN_MAX_FAILURES_PER_IP),
+        }
+
+    def failures(self):
+        """Weighted failure count per scope, read with one cache round trip."""
+        keys = {scope: _keys(scope, ident, self.now) for scope, (ident, _) in self.limits.items()}
+        counts = cache.get_many([key for pair in keys.values() for key in pair])
+        overlap = 1 - (self.now % settings.LOGIN_FAILURE_WINDOW) / settings.LOGIN_FAILURE_WINDOW
+        return {
+            scope: counts.get(current, 0) + counts.get(previous, 0) * overlap
+            for scope, (current, previous) in keys.items()
+        }
+
+    def retry_after(self):
+        """Seconds until the next attempt is allowed, or None if it is allowed now."""
+        failures = self.failures()
+        if all(failures[scope] < limit for scope, (_, limit) in self.limits.items()):
+            return None
+        # The current window's failures only age out when it ends
+        return math.ceil(settings.LOGIN_FAILURE_WINDOW - self.now % settings.LOGIN_FAILURE_WINDOW)
+
+    def record_failure(self):
+        for scope, (ident, _) in self.limits.items():
+            key = _keys(scope, ident, self.now)[0]
+            cache.add(key, 0, timeout=2 * settings.LOGIN_FAILURE_WINDOW)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(key, 1, timeout=2 * settings.LOGIN_FAILURE_WINDOW)
+
+    def reset_username(self):
+        cache.delete_many(_keys('username', self.limits['username'][0], self.now))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from courier_app.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move COMPLETE/RETURNED orders that stopped changing into the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS, help="Archive orders unchanged for N days."
+        )
+        parser.add_argument('--batch-size', type=int, default=None, help="Orders moved per transaction.")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after N batches.")
+
+    def handle(self, *args, **options):
+        moved = archive_orders(
+            before=timezone.now() - timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(f"Archived {moved} order(s).")
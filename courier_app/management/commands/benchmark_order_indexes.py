@@ -0,0 +1,147 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models
+from django.utils import timezone
+
+from courier_app.models import User, Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with orders and compare query plans and "
+        "latency of the role-scoped order lookups with and without the Order indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--customers', type=int, default=5_000)
+        parser.add_argument('--couriers', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        # Never touch the configured database: work in a disposable test copy
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            customers, couriers = self.seed(options)
+            queries = self.build_queries(customers, couriers)
+
+            self.stdout.write(self.style.MIGRATE_HEADING("With composite indexes"))
+            indexed = self.measure(queries, options['repeat'])
+
+            self.drop_indexes()
+            self.stdout.write(self.style.MIGRATE_HEADING("Foreign key indexes only (before 0007)"))
+            baseline = self.measure(queries, options['repeat'])
+
+            self.stdout.write(self.style.MIGRATE_HEADING("Summary (median ms)"))
+            for name in queries:
+                speedup = baseline[name] / indexed[name] if indexed[name] else float('inf')
+                self.stdout.write(
+                    f"{name:<28} before {baseline[name]:>9.2f}  after {indexed[name]:>9.2f}  x{speedup:.1f}"
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, options):
+        self.stdout.write(f"Seeding {options['orders']:,} orders...")
+        User.objects.bulk_create(
+            [User(username=f'customer{i}', role=User.Roles.USER) for i in range(options['customers'])]
+            + [User(username=f'courier{i}', role=User.Roles.DELIVERY_MAN) for i in range(options['couriers'])],
+            batch_size=options['batch_size'],
+        )
+        customers = list(User.objects.filter(role=User.Roles.USER).values_list('id', flat=True))
+        couriers = list(User.objects.filter(role=User.Roles.DELIVERY_MAN).values_list('id', flat=True))
+
+        statuses = Order.StatusChoices.values
+        now = timezone.now()
+        remaining = options['orders']
+        while remaining > 0:
+            size = min(options['batch_size'], remaining)
+            Order.objects.bulk_create([
+                Order(
+                    user_id=random.choice(customers),
+                    delivery_man_id=random.choice(couriers) if random.random() < 0.9 else None,
+                    pickup_address='Pickup',
+                    delivery_address='Drop',
+                    status=random.choice(statuses),
+                    is_paid=random.random() < 0.95,
+                    total_amount=random.randint(5, 500),
+                    created_at=now - timedelta(seconds=random.randint(0, 365 * 24 * 3600)),
+                )
+                for _ in range(size)
+            ])
+            remaining -= size
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return customers, couriers
+
+    def build_queries(self, customers, couriers):
+        customer = random.choice(customers)
+        courier = random.choice(couriers)
+        since = timezone.now() - timedelta(days=7)
+        newest = ('-created_at', '-id')
+        return {
+            'customer orders': lambda: list(Order.objects.filter(user_id=customer).order_by(*newest)[:50]),
+            'courier assigned': lambda: list(Order.objects.filter(delivery_man_id=courier).order_by(*newest)[:50]),
+            'courier in transit': lambda: list(
+                Order.objects.filter(delivery_man_id=courier, status=Order.StatusChoices.IN_TRANSIT)
+                .order_by('-created_at')[:50]
+            ),
+            'admin list': lambda: list(Order.objects.order_by(*newest)[:50]),
+            'unpaid backlog': lambda: list(Order.objects.filter(is_paid=False).order_by('-created_at')[:50]),
+            'delivered last 7 days': lambda: Order.objects.filter(
+                status=Order.StatusChoices.DELIVERED, created_at__gte=since
+            ).count(),
+            'delivery men': lambda: list(User.objects.filter(role=User.Roles.DELIVERY_MAN)[:50]),
+        }
+
+    def measure(self, queries, repeat):
+        results = {}
+        for name, run in queries.items():
+            self.stdout.write(self.style.SQL_KEYWORD(name))
+            self.stdout.write(self.explain(name, run))
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings)
+            self.stdout.write(f"  median {results[name]:.2f} ms over {repeat} runs\n")
+        return results
+
+    def explain(self, name, run):
+        # Re-run the query once to capture its SQL, then ask the planner about it
+        with connection.execute_wrapper(self._capture):
+            self._captured = []
+            run()
+        sql, params = self._captured[-1]
+        with connection.cursor() as cursor:
+            prefix = 'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else 'EXPLAIN'
+            cursor.execute(f'{prefix} {sql}', params)
+            return '\n'.join(f"  {' '.join(str(col) for col in row)}" for row in cursor.fetchall())
+
+    def _capture(self, execute, sql, params, many, context):
+        self._captured.append((sql, params))
+        return execute(sql, params, many, context)
+
+    def drop_indexes(self):
+        # Rebuild the pre-0007 schema: plain FK indexes, no composites, no role index
+        with connection.schema_editor() as editor:
+            for index in Order._meta.indexes:
+                editor.remove_index(Order, index)
+            editor.add_index(Order, models.Index(fields=['user'], name='bench_order_user_idx'))
+            editor.add_index(Order, models.Index(fields=['delivery_man'], name='bench_order_courier_idx'))
+            old_role = User._meta.get_field('role')
+            new_role = models.CharField(max_length=20, choices=User.Roles.choices, default=User.Roles.USER)
+            new_role.set_attributes_from_name('role')
+            new_role.model = User
+            editor.alter_field(User, old_role, new_role)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from courier_app.analytics import compact, rebuild
+
+
+class Command(BaseCommand):
+    help = "Fold appended order analytics rows into one row per bucket, or rebuild them from the orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, default=None, help="Only days from YYYY-MM-DD on.")
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help="Recompute the totals from the orders table; run while orders are not being written.",
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            written = rebuild(since=options['since'])
+            self.stdout.write(f"Rebuilt order analytics: {written} row(s).")
+            return
+        removed, written = compact(since=options['since'])
+        self.stdout.write(f"Compacted {removed} order analytics row(s) into {written}.")
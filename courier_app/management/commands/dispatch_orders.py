@@ -0,0 +1,27 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from courier_app.dispatch import dispatch_pending_orders
+from courier_app.realtime import out_of_process_problem
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Assign pending orders to the nearest available delivery men."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help="Oldest N pending orders only.")
+
+    def handle(self, *args, **options):
+        problem = out_of_process_problem()
+        if problem:
+            logger.warning(problem)
+        started = time.perf_counter()
+        result = dispatch_pending_orders(limit=options['limit'])
+        self.stdout.write(
+            f"Assigned {result['assigned']} order(s) to {result['couriers']} available courier(s) "
+            f"in {time.perf_counter() - started:.2f}s; {result['unassigned']} still pending."
+        )
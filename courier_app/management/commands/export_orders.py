@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courier_app.models import ArchivedOrder, Order, User
+from courier_app.order_export import FORMATS, export_rows, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream orders to a CSV or JSON Lines file (or stdout)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', help="File to write; defaults to stdout.")
+        parser.add_argument('--user', help="Only export the orders this user can see in the API.")
+        parser.add_argument('--after', type=int, help="Resume after this order id.")
+        parser.add_argument('--include-archived', action='store_true', help="Also export archived orders.")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        orders, archived = Order.objects.all(), ArchivedOrder.objects.all()
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']!r} does not exist.")
+            orders, archived = Order.objects.visible_to(user), ArchivedOrder.objects.visible_to(user)
+
+        rows = export_rows(
+            orders,
+            after=options['after'],
+            chunk_size=options['chunk_size'],
+            archived=archived if options['include_archived'] else None,
+        )
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for chunk in stream_export(rows, options['format']):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
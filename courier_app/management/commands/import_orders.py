@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from courier_app.models import User
+from courier_app.order_import import FORMATS, detect_format, import_orders, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk-create orders for a user from a CSV or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help="Username that will own the orders.")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']!r} does not exist.")
+
+        fmt = options['format'] or detect_format(options['path'])
+        with open(options['path'], 'rb') as stream:
+            result = import_orders(iter_rows(stream, fmt), user, chunk_size=options['chunk_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(f"Created {result['created']} order(s), {result['failed']} row(s) failed.")
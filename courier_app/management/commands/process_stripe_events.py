@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from courier_app.payments import process_stripe_events
+
+
+class Command(BaseCommand):
+    help = "Apply any stored Stripe webhook events that have not been processed yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = 0
+        while processed := process_stripe_events(limit=options['batch_size']):
+            total += processed
+        self.stdout.write(f"Processed {total} Stripe event(s).")
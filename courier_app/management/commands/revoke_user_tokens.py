@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from courier_app.models import User
+from courier_app.revocation import revoke_user_sessions
+
+
+class Command(BaseCommand):
+    help = "Revoke every refresh and access token of a user, e.g. when a courier leaves."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--deactivate', action='store_true', help="Also block new logins.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}.")
+
+        with transaction.atomic():
+            revoked = revoke_user_sessions(user)
+            if options['deactivate']:
+                user.is_active = False
+                user.save(update_fields=['is_active'])
+        self.stdout.write(f"Revoked {revoked} session(s) of {user.username}.")
@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from courier_app.payments import process_pending_jobs
+from courier_app.realtime import out_of_process_problem
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process queued Stripe PaymentIntent jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the due jobs once and exit.")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+
+    def handle(self, *args, **options):
+        problem = out_of_process_problem()
+        if problem:
+            logger.warning(problem)
+        while True:
+            try:
+                processed = process_pending_jobs(limit=options['batch_size'])
+            except Exception as e:
+                logger.error(f"Payment worker batch failed: {e}")
+                processed = 0
+
+            if options['once']:
+                self.stdout.write(f"Processed {processed} payment job(s).")
+                return
+            if not processed:
+                time.sleep(options['idle_sleep'])
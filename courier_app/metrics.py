@@ -0,0 +1,309 @@
+"""
+In-process request metrics in the Prometheus text format.
+
+MetricsMiddleware times every request and, per view, records histograms of:
+
+- total latency;
+- database queries and time spent in them (``connection.execute_wrapper``);
+- time spent rendering serializers (``serializer.data``);
+- time spent waiting on the Stripe API.
+
+Stripe calls made outside requests (the payment worker) are recorded per
+API endpoint as well. Values are aggregated in fixed-bucket histograms in
+this process; ``/metrics`` renders them together with the intent and
+response cache hit counters. Every worker process keeps its own numbers,
+so scrape each one (Prometheus adds the instance label).
+
+METRICS_ENABLED=False removes all of it: the middleware (and with it the
+query wrapper), the serializer and Stripe hooks, and the endpoint.
+"""
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse
+
+from .payments import intent_cache
+from .response_cache import response_cache
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set; ``observe`` is a bisect and two additions."""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf) and the sum
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
+
+    def expose(self):
+        with self.lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = (('le', bound),)
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.request_seconds = Histogram(
+            'courier_http_request_duration_seconds', "Request latency.", ('view', 'method'), LATENCY_BUCKETS
+        )
+        self.request_queries = Histogram(
+            'courier_http_request_db_queries', "Database queries per request.", ('view', 'method'), QUERY_BUCKETS
+        )
+        self.request_db_seconds = Histogram(
+            'courier_http_request_db_seconds', "Time in database queries per request.", ('view', 'method'), LATENCY_BUCKETS
+        )
+        self.request_serializer_seconds = Histogram(
+            'courier_http_request_serializer_seconds', "Time rendering serializers per request.", ('view', 'method'),
+            LATENCY_BUCKETS,
+        )
+        self.request_stripe_seconds = Histogram(
+            'courier_http_request_stripe_seconds', "Time waiting on Stripe per request.", ('view', 'method'),
+            LATENCY_BUCKETS,
+        )
+        self.responses = {}
+        self.responses_lock = threading.Lock()
+        self.stripe_seconds = Histogram(
+            'courier_stripe_request_duration_seconds', "Stripe API call latency.", ('endpoint', 'method'),
+            LATENCY_BUCKETS,
+        )
+
+    @property
+    def histograms(self):
+        return (
+            self.request_seconds, self.request_queries, self.request_db_seconds,
+            self.request_serializer_seconds, self.request_stripe_seconds, self.stripe_seconds,
+        )
+
+    def record_request(self, view, method, status_code, measurement):
+        labels = (view, method)
+        self.request_seconds.observe(measurement.elapsed, *labels)
+        if measurement.queries is not None:
+            self.request_queries.observe(measurement.queries, *labels)
+            self.request_db_seconds.observe(measurement.db_seconds, *labels)
+        self.request_serializer_seconds.observe(measurement.serializer_seconds, *labels)
+        self.request_stripe_seconds.observe(measurement.stripe_seconds, *labels)
+        key = (view, method, str(status_code))
+        with self.responses_lock:
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+        with self.responses_lock:
+            self.responses = {}
+
+    def expose(self):
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.expose())
+
+        lines += [
+            "# HELP courier_http_responses_total Responses by status code.",
+            "# TYPE courier_http_responses_total counter",
+        ]
+        with self.responses_lock:
+            responses = sorted(self.responses.items())
+        for labels, count in responses:
+            lines.append(f"courier_http_responses_total{format_labels(('view', 'method', 'status'), labels)} {count}")
+
+        caches = (('payment_intents', intent_cache.stats()), ('order_responses', response_cache.stats()))
+        for counter, help_text in (('hits', "Cache lookups that found an entry."), ('misses', "Cache lookups that missed.")):
+            name = f"courier_cache_{counter}_total"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines += [f"{name}{format_labels(('cache',), (alias,))} {stats[counter]}" for alias, stats in caches]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Measurement:
+    """What one request spent, filled in while it runs."""
+
+    __slots__ = ('started', 'elapsed', 'queries', 'db_seconds', 'serializer_seconds', 'stripe_seconds')
+
+    def __init__(self, count_queries=True):
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        # Queries of async views run in other threads and are not counted
+        self.queries = 0 if count_queries else None
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.stripe_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+
+current = ContextVar('request_measurement', default=None)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    # Route names keep the label set bounded, unlike raw paths with ids
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        measurement = Measurement()
+        token = current.set(measurement)
+        try:
+            with connection.execute_wrapper(measurement):
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        measurement.finish()
+        registry.record_request(view_label(request), request.method, response.status_code, measurement)
+        return response
+
+    async def __acall__(self, request):
+        measurement = Measurement(count_queries=False)
+        token = current.set(measurement)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        measurement.finish()
+        registry.record_request(view_label(request), request.method, response.status_code, measurement)
+        return response
+
+
+def timed_serializer_data(data):
+    """Wrap BaseSerializer.data; nested and list items render inside one outer call."""
+
+    @wraps(data)
+    def wrapper(serializer):
+        measurement = current.get()
+        if measurement is None:
+            return data(serializer)
+        started = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            measurement.serializer_seconds += time.perf_counter() - started
+    wrapper.timed = True
+    return wrapper
+
+
+class TimedStripeClient:
+    """Stripe HTTP client wrapper recording each API call; everything else is delegated."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _timed(self, call, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return call(method, url, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            # "/v1/payment_intents/pi_123/confirm" -> "/v1/payment_intents"
+            endpoint = '/'.join(urlsplit(url).path.split('/')[:3])
+            registry.stripe_seconds.observe(elapsed, endpoint, method.upper())
+            measurement = current.get()
+            if measurement is not None:
+                measurement.stripe_seconds += elapsed
+
+    def request_with_retries(self, method, url, *args, **kwargs):
+        return self._timed(self._client.request_with_retries, method, url, *args, **kwargs)
+
+    def request_stream_with_retries(self, method, url, *args, **kwargs):
+        return self._timed(self._client.request_stream_with_retries, method, url, *args, **kwargs)
+
+
+def install():
+    """Hook serializer and Stripe timing in; called once from AppConfig.ready()."""
+    import stripe
+    from rest_framework.serializers import BaseSerializer
+
+    if not getattr(BaseSerializer.data.fget, 'timed', False):
+        BaseSerializer.data = property(timed_serializer_data(BaseSerializer.data.fget))
+    if not isinstance(stripe.default_http_client, TimedStripeClient):
+        client = stripe.default_http_client or stripe.new_default_http_client(
+            verify_ssl_certs=stripe.verify_ssl_certs, proxy=stripe.proxy
+        )
+        stripe.default_http_client = TimedStripeClient(client)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, guarded by a bearer token (METRICS_TOKEN)."""
+    token = settings.METRICS_TOKEN
+    if not token or not settings.METRICS_ENABLED:
+        raise Http404
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(registry.expose(), content_type=CONTENT_TYPE)
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courier_app", "0010_stripeevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderStatusEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "from_status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("PICKED", "Picked"),
+                            ("IN_TRANSIT", "In Transit"),
+                            ("RETURNED", "Returned"),
+                            ("DELIVERED", "Delivered"),
+                            ("COMPLETE", "Complete"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "to_status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("PICKED", "Picked"),
+                            ("IN_TRANSIT", "In Transit"),
+                            ("RETURNED", "Returned"),
+                            ("DELIVERED", "Delivered"),
+                            ("COMPLETE", "Complete"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "changed_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="status_events",
+                        to="courier_app.order",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["order", "created_at"],
+                        name="statusevent_order_created_idx",
+                    )
+                ],
+            },
+        ),
+    ]
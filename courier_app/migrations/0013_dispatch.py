@@ -0,0 +1,74 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courier_app", "0012_user_token_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CourierLocation",
+            fields=[
+                (
+                    "courier",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="location",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("lat", models.FloatField()),
+                ("lng", models.FloatField()),
+                ("geohash", models.CharField(max_length=12)),
+                ("is_available", models.BooleanField(default=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="delivery_lat",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="delivery_lng",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="pickup_geohash",
+            field=models.CharField(blank=True, default="", max_length=12),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="pickup_lat",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="pickup_lng",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                condition=models.Q(("delivery_man__isnull", True)),
+                fields=["status", "pickup_geohash"],
+                name="order_unassigned_cell_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="courierlocation",
+            index=models.Index(
+                fields=["is_available", "geohash"], name="courier_location_cell_idx"
+            ),
+        ),
+    ]
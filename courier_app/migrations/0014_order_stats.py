@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courier_app", "0013_dispatch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OrderStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("PICKED", "Picked"),
+                            ("IN_TRANSIT", "In Transit"),
+                            ("RETURNED", "Returned"),
+                            ("DELIVERED", "Delivered"),
+                            ("COMPLETE", "Complete"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("courier_id", models.IntegerField(blank=True, null=True)),
+                ("orders", models.IntegerField(default=0)),
+                ("paid_orders", models.IntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "paid_revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["day", "status"], name="orderstat_day_idx")
+                ],
+            },
+        ),
+    ]
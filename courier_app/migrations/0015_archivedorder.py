@@ -0,0 +1,107 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:53
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courier_app", "0014_order_stats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedOrder",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("pickup_address", models.CharField(max_length=255)),
+                ("delivery_address", models.CharField(max_length=255)),
+                ("pickup_lat", models.FloatField(blank=True, null=True)),
+                ("pickup_lng", models.FloatField(blank=True, null=True)),
+                (
+                    "pickup_geohash",
+                    models.CharField(blank=True, default="", max_length=12),
+                ),
+                ("delivery_lat", models.FloatField(blank=True, null=True)),
+                ("delivery_lng", models.FloatField(blank=True, null=True)),
+                ("package_details", models.TextField(blank=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("PICKED", "Picked"),
+                            ("IN_TRANSIT", "In Transit"),
+                            ("RETURNED", "Returned"),
+                            ("DELIVERED", "Delivered"),
+                            ("COMPLETE", "Complete"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("created_at", models.DateTimeField()),
+                ("updated_at", models.DateTimeField()),
+                (
+                    "stripe_payment_intent",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                ("is_paid", models.BooleanField(default=False)),
+                (
+                    "total_amount",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=10, null=True
+                    ),
+                ),
+                (
+                    "payment_method",
+                    models.CharField(blank=True, max_length=50, null=True),
+                ),
+                (
+                    "status_history",
+                    models.JSONField(
+                        default=list,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                    ),
+                ),
+                (
+                    "archived_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "delivery_man",
+                    models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_orders",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "created_at"], name="archivedorder_user_idx"
+                    ),
+                    models.Index(
+                        fields=["delivery_man", "created_at"],
+                        name="archivedorder_courier_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:07
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("courier_app", "0015_archivedorder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedorder",
+            name="payment_jobs",
+            field=models.JSONField(
+                default=list, encoder=django.core.serializers.json.DjangoJSONEncoder
+            ),
+        ),
+    ]
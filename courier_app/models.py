@@ -1,7 +1,10 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
 from django.utils import timezone
 
+from .realtime import publish_order_change
+
 
 class User(AbstractUser):
     class Roles(models.TextChoices):
@@ -13,12 +16,65 @@ class User(AbstractUser):
         max_length=20,
         choices=Roles.choices,
         default=Roles.USER,
+        db_index=True,
     )
+    # Carried in access tokens; bumping it revokes every token issued before
+    token_version = models.PositiveIntegerField(default=0)
+
+    # Changing any of these invalidates the claims in outstanding tokens
+    TOKEN_FIELDS = ('role', 'password', 'is_active')
 
     def __str__(self):
         return f"{self.username} ({self.role})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_values', None)
+        update_fields = kwargs.get('update_fields')
+        # check_password() re-hashing with a newer hasher is not a password change
+        rehash = update_fields is not None and list(update_fields) == ['password'] and self._password is None
+        if loaded is not None and not rehash and any(
+            field in loaded and loaded[field] != getattr(self, field) for field in self.TOKEN_FIELDS
+        ):
+            self.token_version = loaded.get('token_version', self.token_version) + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'token_version'}
+        super().save(*args, **kwargs)
+        # The saved values are the new baseline; deferred fields stay unloaded
+        self._loaded_values = {
+            field: self.__dict__[field] for field in (*self.TOKEN_FIELDS, 'token_version') if field in self.__dict__
+        }
+
+    def revoke_tokens(self):
+        """Invalidate every access token issued to this user so far."""
+        self.token_version += 1
+        self.save(update_fields=['token_version'])
     
 
+class OrderQuerySet(models.QuerySet):
+    def with_related(self):
+        # OrderSerializer renders both users via __str__, so join them up front
+        return self.select_related('user', 'delivery_man')
+
+    def visible_to(self, user):
+        """Orders ``user`` may see: all for admins, assigned for delivery men, own otherwise."""
+        if user.role == User.Roles.ADMIN:
+            return self.all()
+        elif user.role == User.Roles.DELIVERY_MAN:
+            return self.filter(delivery_man=user)
+        else:  # regular user
+            return self.filter(user=user)
+
+
+class InvalidStatusTransition(Exception):
+    pass
+
+
 class Order(models.Model):
     class StatusChoices(models.TextChoices):
         PENDING = "PENDING", "Pending"
@@ -28,16 +84,34 @@ class Order(models.Model):
         DELIVERED = "DELIVERED", "Delivered"
         COMPLETE = "COMPLETE", "Complete"
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
-    delivery_man = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_orders')
+    # Allowed next statuses for each status
+    TRANSITIONS = {
+        StatusChoices.PENDING: {StatusChoices.PICKED},
+        StatusChoices.PICKED: {StatusChoices.IN_TRANSIT},
+        StatusChoices.IN_TRANSIT: {StatusChoices.DELIVERED, StatusChoices.RETURNED},
+        StatusChoices.DELIVERED: {StatusChoices.COMPLETE},
+        StatusChoices.RETURNED: {StatusChoices.COMPLETE},
+        StatusChoices.COMPLETE: set(),
+    }
+
+    # Both FKs are covered by the composite indexes in Meta, so they skip their own
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders', db_index=False)
+    delivery_man = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_orders', db_index=False)
     pickup_address = models.CharField(max_length=255)
     delivery_address = models.CharField(max_length=255)
+    # Filled by the client or geocoded at dispatch time, see courier_app.dispatch
+    pickup_lat = models.FloatField(null=True, blank=True)
+    pickup_lng = models.FloatField(null=True, blank=True)
+    pickup_geohash = models.CharField(max_length=12, blank=True, default='')
+    delivery_lat = models.FloatField(null=True, blank=True)
+    delivery_lng = models.FloatField(null=True, blank=True)
     package_details = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDING)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
-    stripe_payment_intent = models.CharField(max_length=255, null=True, blank=True)
+    # Webhook events are matched to orders by intent id
+    stripe_payment_intent = models.CharField(max_length=255, null=True, blank=True, db_index=True)
     is_paid = models.BooleanField(default=False)
 
     # Consider removing null=True, blank=True if you want DB-level enforcement
@@ -50,5 +124,249 @@ class Order(models.Model):
         help_text="e.g., 'card', 'cash', 'stripe'"
     )
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Courier views: assigned orders, optionally sliced by status
+            models.Index(fields=['delivery_man', 'status', 'created_at'], name='order_courier_status_idx'),
+            # Customer views: own orders, newest first
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            # Admin list and cursor pagination
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+            # Dashboards by status over a date range
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # Unpaid backlog is a small slice of the table
+            models.Index(fields=['created_at'], condition=models.Q(is_paid=False), name='order_unpaid_idx'),
+            # Dispatch queue: unassigned orders by pickup cell
+            models.Index(
+                fields=['status', 'pickup_geohash'],
+                condition=models.Q(delivery_man__isnull=True),
+                name='order_unassigned_cell_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.status}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded values so signal handlers can tell what changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The saved values are the baseline for the next save; deferred fields stay unloaded
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    @classmethod
+    def can_transition(cls, from_status, to_status):
+        return to_status in cls.TRANSITIONS.get(from_status, set())
+
+    def transition_to(self, status, by=None):
+        """Move to ``status`` and record the change, touching only the status columns."""
+        if not self.can_transition(self.status, status):
+            raise InvalidStatusTransition(f"Cannot move order from {self.status} to {status}.")
+        previous = self.status
+        with transaction.atomic():
+            self.status = status
+            self.save(update_fields=['status', 'updated_at'])
+            OrderStatusEvent.objects.create(order=self, from_status=previous, to_status=status, changed_by=by)
+            publish_order_change(self.id, status, self.user_id, self.delivery_man_id)
+
+
+class OrderStatusEvent(models.Model):
+    """Append-only record of an order status change."""
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='status_events')
+    from_status = models.CharField(max_length=20, choices=Order.StatusChoices.choices)
+    to_status = models.CharField(max_length=20, choices=Order.StatusChoices.choices)
+    changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='statusevent_order_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Order status events are append-only.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Order #{self.order_id}: {self.from_status} -> {self.to_status}"
+
+
+class PaymentJob(models.Model):
+    """A queued request to create (or look up) the Stripe PaymentIntent for an order."""
+
+    class StatusChoices(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        RUNNING = "RUNNING", "Running"
+        SUCCEEDED = "SUCCEEDED", "Succeeded"
+        FAILED = "FAILED", "Failed"
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='payment_jobs')
+    status = models.CharField(max_length=20, choices=StatusChoices.choices, default=StatusChoices.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    client_secret = models.CharField(max_length=255, null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Workers poll for due jobs in this order
+            models.Index(fields=['status', 'run_after'], name='paymentjob_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"PaymentJob #{self.id} for order #{self.order_id} - {self.status}"
+
+
+class IdempotencyKey(models.Model):
+    """The stored outcome of a request sent with an ``Idempotency-Key`` header."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Both stay empty while the original request is still running
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.path} [{self.key}]"
+
+
+class StripeEvent(models.Model):
+    """A received Stripe webhook event. The primary key dedupes redeliveries."""
+
+    id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=100)
+    payment_intent = models.CharField(max_length=255, blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['received_at'],
+                condition=models.Q(processed_at__isnull=True),
+                name='stripeevent_pending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.id}"
+
+
+class CourierLocation(models.Model):
+    """Last reported position of a delivery man and whether they take new orders."""
+
+    courier = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='location')
+    lat = models.FloatField()
+    lng = models.FloatField()
+    geohash = models.CharField(max_length=12)
+    is_available = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Available couriers by cell prefix
+            models.Index(fields=['is_available', 'geohash'], name='courier_location_cell_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.courier_id} @ {self.lat:.5f},{self.lng:.5f}"
+
+
+class OrderStat(models.Model):
+    """
+    Order totals for one (day, status, courier) bucket, or a change to them.
+
+    Rows are appended as orders change and folded together by the
+    compact_order_stats command; see courier_app.analytics.
+    """
+
+    # Creation date of the counted orders
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.StatusChoices.choices)
+    # Not a foreign key so totals outlive deleted couriers; null while unassigned
+    courier_id = models.IntegerField(null=True, blank=True)
+    orders = models.IntegerField(default=0)
+    paid_orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            # Dashboards read a date range
+            models.Index(fields=['day', 'status'], name='orderstat_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.status} courier={self.courier_id}: {self.orders:+d}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    A finished order moved out of the Order table by courier_app.archive.
+
+    Keeps the order's id and columns; its status events and payment jobs are
+    kept as JSON.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders', db_index=False)
+    delivery_man = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', db_index=False)
+    pickup_address = models.CharField(max_length=255)
+    delivery_address = models.CharField(max_length=255)
+    pickup_lat = models.FloatField(null=True, blank=True)
+    pickup_lng = models.FloatField(null=True, blank=True)
+    pickup_geohash = models.CharField(max_length=12, blank=True, default='')
+    delivery_lat = models.FloatField(null=True, blank=True)
+    delivery_lng = models.FloatField(null=True, blank=True)
+    package_details = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=Order.StatusChoices.choices)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    stripe_payment_intent = models.CharField(max_length=255, null=True, blank=True)
+    is_paid = models.BooleanField(default=False)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    payment_method = models.CharField(max_length=50, blank=True, null=True)
+    # Rendered by OrderStatusEventSerializer, oldest first
+    status_history = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    # The order's PaymentJob rows (ARCHIVED_PAYMENT_JOB_FIELDS), oldest first
+    payment_jobs = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archivedorder_user_idx'),
+            models.Index(fields=['delivery_man', 'created_at'], name='archivedorder_courier_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order #{self.id} - {self.status}"
@@ -0,0 +1,105 @@
+"""
+Set-based dispatch operations on many orders at once.
+
+Each operation reads the affected orders with one query, decides per order
+whether it applies, then changes all applicable rows with a single
+``UPDATE ... WHERE id IN (...)`` inside one transaction.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import ROLLUP_FIELDS, record_changes
+from .dispatch import ACTIVE_STATUSES
+from .models import Order, OrderStatusEvent
+from .realtime import publish_order_change
+from .response_cache import invalidate_orders
+
+# Upper bound on order ids per request, keeps the IN (...) list sane
+MAX_BULK_ORDERS = 5000
+
+
+def bulk_assign(order_ids, courier, actor):
+    """
+    Assign the orders ``actor`` can see to ``courier``. Only orders still in
+    progress (ACTIVE_STATUSES) move; finished ones are reported as
+    ``invalid_status``. Returns per-order results.
+    """
+    with transaction.atomic():
+        # Locked so the statuses checked are the statuses changed, and the
+        # recorded analytics deltas start from the values overwritten
+        rows = {
+            row['id']: row
+            for row in Order.objects.visible_to(actor).filter(id__in=order_ids).select_for_update()
+            .values('id', 'user_id', *ROLLUP_FIELDS)
+        }
+        assignable = {order_id: row for order_id, row in rows.items() if row['status'] in ACTIVE_STATUSES}
+        updated = Order.objects.filter(id__in=assignable).update(delivery_man=courier, updated_at=timezone.now())
+        record_changes((row, {**row, 'delivery_man_id': courier.id}) for row in assignable.values())
+        for order_id, row in assignable.items():
+            publish_order_change(
+                order_id, row['status'], row['user_id'], courier.id,
+                event='assigned', previous_delivery_man_id=row['delivery_man_id'],
+            )
+        invalidate_orders(
+            (row['user_id'], courier_id)
+            for row in assignable.values()
+            for courier_id in (courier.id, row['delivery_man_id'])
+        )
+
+    results = []
+    for order_id in order_ids:
+        if order_id not in rows:
+            result = 'not_found'
+        elif order_id in assignable:
+            result = 'assigned'
+        else:
+            result = 'invalid_status'
+        results.append({'id': order_id, 'result': result})
+    return {'updated': updated, 'results': results}
+
+
+def bulk_transition(order_ids, new_status, actor):
+    """
+    Move the orders ``actor`` can see to ``new_status``, following
+    Order.TRANSITIONS, and record one status event per moved order.
+    Returns per-order results.
+    """
+    with transaction.atomic():
+        # Lock the rows so the statuses checked are the statuses changed
+        rows = {
+            row['id']: row
+            for row in Order.objects.visible_to(actor).filter(id__in=order_ids).select_for_update()
+            .values('id', 'user_id', *ROLLUP_FIELDS)
+        }
+        current = {order_id: row['status'] for order_id, row in rows.items()}
+        parties = {order_id: (row['user_id'], row['delivery_man_id']) for order_id, row in rows.items()}
+        movable = {order_id for order_id, status in current.items() if Order.can_transition(status, new_status)}
+        now = timezone.now()
+        updated = Order.objects.filter(id__in=movable).update(status=new_status, updated_at=now)
+        record_changes((rows[order_id], {**rows[order_id], 'status': new_status}) for order_id in movable)
+        OrderStatusEvent.objects.bulk_create(
+            OrderStatusEvent(
+                order_id=order_id,
+                from_status=current[order_id],
+                to_status=new_status,
+                changed_by=actor,
+                created_at=now,
+            )
+            for order_id in movable
+        )
+        for order_id in movable:
+            publish_order_change(order_id, new_status, *parties[order_id])
+        invalidate_orders(parties[order_id] for order_id in movable)
+
+    results = []
+    for order_id in order_ids:
+        if order_id not in current:
+            result = 'not_found'
+        elif current[order_id] == new_status:
+            result = 'unchanged'
+        elif order_id in movable:
+            result = 'updated'
+        else:
+            result = 'invalid_transition'
+        results.append({'id': order_id, 'result': result})
+    return {'updated': updated, 'results': results}
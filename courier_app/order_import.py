@@ -0,0 +1,100 @@
+"""
+Bulk order import from CSV or JSON Lines.
+
+Rows are read lazily from the stream and handled in chunks: every row is
+validated with the OrderSerializer rules, the chunk's delivery men are
+resolved with one query and the valid rows are written with one bulk INSERT.
+"""
+import codecs
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from rest_framework import serializers
+
+from .analytics import record_changes, rollup_values
+from .models import Order, User
+from .response_cache import invalidate_orders
+from .serializers import OrderImportSerializer
+
+FORMATS = ('csv', 'jsonl')
+
+# Cap on the per-row errors echoed back; the failed count is always exact
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_format(name='', content_type=''):
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_rows(stream, fmt):
+    """Yield ``(row_number, data)`` from a binary stream, one line at a time."""
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            # Empty CSV cells mean "not given", not an empty value
+            yield number, {key: value for key, value in row.items() if key and value not in ('', None)}
+    else:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, e
+
+
+def import_orders(rows, user, chunk_size=1000):
+    """
+    Create orders owned by ``user`` from ``(row_number, data)`` pairs.
+
+    Returns ``{'created', 'failed', 'errors'}`` where ``errors`` lists the
+    row number and field errors of rejected rows.
+    """
+    result = {'created': 0, 'failed': 0, 'errors': []}
+    serializer = OrderImportSerializer()
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        orders = _validate_chunk(serializer, chunk, user, result)
+        with transaction.atomic():
+            Order.objects.bulk_create(orders, batch_size=chunk_size)
+            # bulk_create sends no post_save signals
+            invalidate_orders({(order.user_id, order.delivery_man_id) for order in orders})
+            record_changes((None, rollup_values(order)) for order in orders)
+        result['created'] += len(orders)
+    return result
+
+
+def _validate_chunk(serializer, chunk, user, result):
+    courier_ids = set()
+    for _, data in chunk:
+        if isinstance(data, dict) and data.get('delivery_man_id') not in (None, ''):
+            try:
+                courier_ids.add(int(data['delivery_man_id']))
+            except (TypeError, ValueError):
+                pass  # reported by the serializer below
+    couriers = set(
+        User.objects.filter(role=User.Roles.DELIVERY_MAN, id__in=courier_ids).values_list('id', flat=True)
+    )
+
+    orders = []
+    for number, data in chunk:
+        try:
+            if not isinstance(data, dict):
+                raise serializers.ValidationError({'non_field_errors': [f"Invalid row: {data}"]})
+            validated = serializer.run_validation(data)
+            courier_id = validated.get('delivery_man_id')
+            if courier_id is not None and courier_id not in couriers:
+                raise serializers.ValidationError(
+                    {'delivery_man_id': [f'Invalid pk "{courier_id}" - object does not exist.']}
+                )
+        except serializers.ValidationError as e:
+            result['failed'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'row': number, 'errors': e.detail})
+            continue
+        orders.append(Order(user=user, **validated))
+    return orders
@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination for order lists, newest first.
+
+    DRF encodes only the first ordering field in the cursor: the created_at
+    of the page boundary, plus an offset counting the rows that share that
+    timestamp (id just makes their order deterministic). Pages stay stable
+    while new orders are being inserted, and each page is one indexed range
+    query on created_at whatever the table size; only orders created in the
+    same instant are skipped by offset.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
@@ -0,0 +1,281 @@
+"""
+Stripe PaymentIntent pipeline.
+
+Views never talk to Stripe directly: they enqueue a PaymentJob and return.
+Jobs are picked up by ``manage.py run_payment_worker`` (or run inline after
+commit when PAYMENT_JOBS_EAGER is set) and the resulting client_secret is
+stored on the job for the client to poll.
+
+Payment outcomes come back through the Stripe webhook: events are stored once
+per event id and applied to orders in batches.
+
+Intent metadata fetched from Stripe is kept in the ``payment_intents`` cache
+until it expires or a webhook event for the intent arrives.
+"""
+import logging
+from datetime import timedelta
+from functools import partial
+
+import stripe
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .analytics import ROLLUP_FIELDS, record_changes
+from .models import Order, PaymentJob, StripeEvent
+from .response_cache import invalidate_orders
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+logger = logging.getLogger(__name__)
+
+# A RUNNING job that has not been touched for this long belongs to a dead worker
+STALE_AFTER = timedelta(minutes=5)
+
+PAYMENT_SUCCEEDED = 'payment_intent.succeeded'
+PAYMENT_FAILED = 'payment_intent.payment_failed'
+HANDLED_EVENTS = (PAYMENT_SUCCEEDED, PAYMENT_FAILED)
+
+
+class IntentCache:
+    """Cache of PaymentIntent metadata keyed by intent id, with hit/miss counters."""
+
+    def __init__(self, alias='payment_intents'):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, intent_id):
+        return f"intent:{intent_id}"
+
+    def get(self, intent_id):
+        data = self.cache.get(self.key(intent_id))
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def set(self, intent):
+        data = {'id': intent.id, 'client_secret': intent.client_secret, 'status': getattr(intent, 'status', None)}
+        self.cache.set(self.key(intent.id), data, timeout=settings.PAYMENT_INTENT_CACHE_TTL)
+        return data
+
+    def invalidate(self, *intent_ids):
+        self.cache.delete_many([self.key(intent_id) for intent_id in intent_ids])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+intent_cache = IntentCache()
+
+
+def retrieve_intent(intent_id):
+    """Intent metadata from the cache, falling back to Stripe."""
+    data = intent_cache.get(intent_id)
+    if data is None:
+        data = intent_cache.set(stripe.PaymentIntent.retrieve(intent_id))
+    return data
+
+
+def latest_payment_job(order):
+    return order.payment_jobs.order_by('-created_at', '-id').first()
+
+
+def enqueue_payment_intent(order, new_order=False):
+    """
+    Queue PaymentIntent creation for ``order`` and return the job.
+
+    An order has at most one job in flight; a job that already succeeded is
+    returned as is so repeated "pay" requests do not reach Stripe again. The
+    job row is the outbox entry: written in the caller's transaction, and with
+    PAYMENT_JOBS_EAGER run only after that transaction commits, so Stripe is
+    never called while it holds locks. ``new_order`` skips the lookup of
+    earlier jobs for an order created in the same transaction.
+    """
+    job = None if new_order else latest_payment_job(order)
+    if job is None or job.status == PaymentJob.StatusChoices.FAILED:
+        cached = intent_cache.get(order.stripe_payment_intent) if order.stripe_payment_intent else None
+        if cached is not None:
+            # Nothing to ask Stripe: answer straight from the cached intent
+            job = PaymentJob.objects.create(
+                order=order,
+                status=PaymentJob.StatusChoices.SUCCEEDED,
+                client_secret=cached['client_secret'],
+            )
+        else:
+            job = PaymentJob.objects.create(order=order)
+
+    if settings.PAYMENT_JOBS_EAGER and job.status == PaymentJob.StatusChoices.PENDING:
+        transaction.on_commit(partial(run_claimed_job, job))
+    return job
+
+
+def run_claimed_job(job):
+    """Run ``job`` in this process unless a worker claimed it first."""
+    if claim_job(job.id):
+        job.refresh_from_db()
+        run_job(job)
+
+
+def _due(now):
+    # Jobs that used up PAYMENT_JOB_MAX_ATTEMPTS are never claimed again, even
+    # when the worker running the last attempt died (see fail_abandoned_jobs)
+    due = Q(status=PaymentJob.StatusChoices.PENDING, run_after__lte=now) | Q(
+        status=PaymentJob.StatusChoices.RUNNING, updated_at__lt=now - STALE_AFTER
+    )
+    return due & Q(attempts__lt=settings.PAYMENT_JOB_MAX_ATTEMPTS)
+
+
+def fail_abandoned_jobs(now):
+    """Mark stale RUNNING jobs without attempts left as FAILED. Returns how many."""
+    return PaymentJob.objects.filter(
+        status=PaymentJob.StatusChoices.RUNNING,
+        updated_at__lt=now - STALE_AFTER,
+        attempts__gte=settings.PAYMENT_JOB_MAX_ATTEMPTS,
+    ).update(
+        status=PaymentJob.StatusChoices.FAILED,
+        last_error="Worker stopped during the last attempt.",
+        updated_at=now,
+    )
+
+
+def claim_job(job_id):
+    """Atomically move a due job to RUNNING. Returns False if another worker won."""
+    now = timezone.now()
+    claimed = PaymentJob.objects.filter(_due(now), id=job_id).update(
+        status=PaymentJob.StatusChoices.RUNNING,
+        attempts=F('attempts') + 1,
+        updated_at=now,
+    )
+    return claimed == 1
+
+
+def run_job(job):
+    order = job.order
+    try:
+        if order.stripe_payment_intent:
+            client_secret = retrieve_intent(order.stripe_payment_intent)['client_secret']
+        else:
+            intent = stripe.PaymentIntent.create(
+                amount=int(order.total_amount * 100),  # dollars to cents
+                currency='usd',
+                metadata={'order_id': str(order.id)},
+                automatic_payment_methods={'enabled': True},
+                # Retries of the same job must never produce a second intent;
+                # a new job after a FAILED one must not replay its error
+                idempotency_key=f"payment-job-{job.id}",
+            )
+            Order.objects.filter(id=order.id).update(
+                stripe_payment_intent=intent.id,
+                payment_method='stripe',
+                updated_at=timezone.now(),
+            )
+            invalidate_orders([(order.user_id, order.delivery_man_id)])
+            intent_cache.set(intent)
+            client_secret = intent.client_secret
+    except stripe.error.StripeError as e:
+        logger.error(f"Stripe error in payment job #{job.id} for order #{order.id}: {e}")
+        return retry_later(job, e)
+    except Exception as e:
+        # Left RUNNING, the job would be reclaimed as stale forever
+        logger.exception(f"Payment job #{job.id} for order #{order.id} crashed")
+        return retry_later(job, e)
+
+    job.client_secret = client_secret
+    job.status = PaymentJob.StatusChoices.SUCCEEDED
+    job.last_error = ''
+    job.save(update_fields=['status', 'client_secret', 'last_error', 'updated_at'])
+    return job
+
+
+def retry_later(job, error):
+    """Reschedule ``job`` with exponential backoff, or fail it once out of attempts."""
+    job.last_error = str(error) or type(error).__name__
+    if job.attempts >= settings.PAYMENT_JOB_MAX_ATTEMPTS:
+        job.status = PaymentJob.StatusChoices.FAILED
+    else:
+        job.status = PaymentJob.StatusChoices.PENDING
+        job.run_after = timezone.now() + timedelta(seconds=2 ** job.attempts)
+    job.save(update_fields=['status', 'last_error', 'run_after', 'updated_at'])
+    return job
+
+
+def process_pending_jobs(limit=50):
+    """Run up to ``limit`` due jobs and return how many were processed."""
+    now = timezone.now()
+    fail_abandoned_jobs(now)
+    due = (
+        PaymentJob.objects.filter(_due(now))
+        .order_by('run_after', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+    processed = 0
+    for job_id in list(due):
+        if not claim_job(job_id):
+            continue
+        run_job(PaymentJob.objects.select_related('order').get(id=job_id))
+        processed += 1
+    return processed
+
+
+def record_stripe_event(event):
+    """Store a verified webhook event. Returns False for a redelivered event id."""
+    if event['type'] not in HANDLED_EVENTS:
+        return False
+    _, created = StripeEvent.objects.get_or_create(
+        id=event['id'],
+        defaults={'type': event['type'], 'payment_intent': event['data']['object']['id']},
+    )
+    return created
+
+
+def process_stripe_events(limit=500):
+    """
+    Apply pending webhook events to orders with one UPDATE per event type.
+
+    Returns the number of events processed. Applying an event twice is
+    harmless, so concurrent runs need no locking.
+    """
+    events = list(
+        StripeEvent.objects.filter(processed_at__isnull=True)
+        .order_by('received_at')
+        .values_list('id', 'type', 'payment_intent')[:limit]
+    )
+    if not events:
+        return 0
+
+    now = timezone.now()
+    succeeded = {intent for _, type, intent in events if type == PAYMENT_SUCCEEDED}
+    failed = {intent for _, type, intent in events if type == PAYMENT_FAILED} - succeeded
+
+    if succeeded:
+        with transaction.atomic():
+            paid = {
+                row['id']: row
+                for row in Order.objects.filter(stripe_payment_intent__in=succeeded, is_paid=False)
+                .select_for_update().values('id', 'user_id', *ROLLUP_FIELDS)
+            }
+            Order.objects.filter(id__in=paid).update(is_paid=True, updated_at=now)
+            record_changes((row, {**row, 'is_paid': True}) for row in paid.values())
+            invalidate_orders((row['user_id'], row['delivery_man_id']) for row in paid.values())
+    for intent in failed:
+        # The intent stays usable: the customer can retry with the same client_secret
+        logger.info(f"Stripe reported a failed payment for intent {intent}")
+    # Whatever we cached about these intents is stale now
+    intent_cache.invalidate(*succeeded, *failed)
+
+    StripeEvent.objects.filter(id__in=[event_id for event_id, _, _ in events]).update(processed_at=now)
+    return len(events)
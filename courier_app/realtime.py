@@ -0,0 +1,177 @@
+"""
+Push notifications for order changes.
+
+Changes are published on a per-user channel (the order's owner and its
+delivery man) and streamed to browsers as Server-Sent Events by
+``views.order_events``. The broker is pluggable through ORDER_EVENTS_BROKER:
+RedisBroker (the default with REDIS_URL) reaches every process, InMemoryBroker
+(the default without) only subscribers in the same process. Brokers that
+reach every process declare ``shared = True``; without one the stream is
+refused when more than one web process runs (WEB_CONCURRENCY), and changes
+made by other processes (the payment worker, management commands) are not
+streamed at all.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+class Subscription:
+    """An asyncio queue bound to the event loop that created it."""
+
+    def __init__(self, broker, channel, max_pending):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+    def deliver(self, message):
+        # May be called from any thread: hand the message to the owning loop
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning(f"Dropping order event for slow subscriber on {self.channel}")
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InMemoryBroker:
+    """Process-local pub/sub. Suitable for a single ASGI process and for tests."""
+
+    shared = False
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_pending)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(message)
+            except RuntimeError:
+                # The subscriber's event loop is gone
+                self.unsubscribe(subscription)
+
+
+class RedisBroker(InMemoryBroker):
+    """
+    Redis pub/sub, so changes made in any process (web workers, the payment
+    worker, management commands) reach subscribers in every web process. A
+    listener thread starts with the first subscription and hands messages to
+    the local subscribers.
+    """
+
+    shared = True
+
+    def __init__(self, max_pending=100, url=None, prefix='order-events:'):
+        import redis
+
+        super().__init__(max_pending)
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.errors = redis.RedisError
+        self.prefix = prefix
+        self._listener = None
+
+    def subscribe(self, channel):
+        with self._lock:
+            if self._listener is None:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(**{f"{self.prefix}*": self._receive})
+                self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        return super().subscribe(channel)
+
+    def _receive(self, message):
+        super().publish(message['channel'].decode().removeprefix(self.prefix), message['data'].decode())
+
+    def publish(self, channel, message):
+        try:
+            self.client.publish(f"{self.prefix}{channel}", message)
+        except self.errors as e:
+            # Events are best effort; the change itself is committed
+            logger.error(f"Could not publish order event on {channel}: {e}")
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.ORDER_EVENTS_BROKER)()
+    return _broker
+
+
+def broker_problem():
+    """Why the configured broker cannot reach every stream subscriber, or None."""
+    if settings.WEB_CONCURRENCY > 1 and not getattr(get_broker(), 'shared', False):
+        return (
+            f"ORDER_EVENTS_BROKER {settings.ORDER_EVENTS_BROKER} only reaches its own process, "
+            f"but WEB_CONCURRENCY is {settings.WEB_CONCURRENCY}"
+        )
+    return None
+
+
+def out_of_process_problem():
+    """Why order changes made by this non-web process will not be streamed, or None."""
+    if not getattr(get_broker(), 'shared', False):
+        return (
+            f"ORDER_EVENTS_BROKER {settings.ORDER_EVENTS_BROKER} only reaches its own process: "
+            f"order changes made here are not streamed to clients"
+        )
+    return None
+
+
+def publish_order_change(order_id, status, user_id, delivery_man_id, event='status', previous_delivery_man_id=None):
+    """
+    Tell the owner and the delivery man about an order change once the
+    transaction commits; on a reassignment the previous delivery man hears too.
+    """
+    message = json.dumps(
+        {'event': event, 'order_id': order_id, 'status': status, 'delivery_man_id': delivery_man_id},
+        cls=DjangoJSONEncoder,
+    )
+    recipients = {user_id, delivery_man_id, previous_delivery_man_id} - {None}
+
+    def send():
+        broker = get_broker()
+        for recipient in recipients:
+            broker.publish(user_channel(recipient), message)
+
+    transaction.on_commit(send)
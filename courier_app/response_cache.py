@@ -0,0 +1,133 @@
+"""
+Per-user cache of rendered order list responses.
+
+Entries are keyed by (role, user id, path and query string) plus a version
+number for the data scope they were built from: everything for admins, the
+assigned orders for a delivery man, the own orders for a customer. Writing an
+order bumps the versions of the scopes that can see it, which orphans their
+entries instead of deleting them one by one.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from .conditional import is_not_modified
+from .models import User
+
+ALL_ORDERS = 'all'
+
+# Headers replayed with a cached body
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+
+def scope_for(user):
+    if user.role == User.Roles.ADMIN:
+        return ALL_ORDERS
+    elif user.role == User.Roles.DELIVERY_MAN:
+        return f"courier:{user.pk}"
+    return f"user:{user.pk}"
+
+
+class ResponseCache:
+    """Versioned response cache with hit/miss counters."""
+
+    def __init__(self, alias='order_responses'):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version(self, scope):
+        key = f"version:{scope}"
+        version = self.cache.get(key)
+        if version is None:
+            # Start from the clock so an evicted counter never reuses old entries
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    def bump(self, *scopes):
+        for scope in set(scopes):
+            try:
+                self.cache.incr(f"version:{scope}")
+            except ValueError:
+                self.cache.set(f"version:{scope}", time.time_ns(), timeout=None)
+
+    def key(self, request):
+        user = request.user
+        scope = scope_for(user)
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f"response:{user.role}:{user.pk}:{self.version(scope)}:{path}"
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, response):
+        entry = {
+            'data': response.data,
+            'headers': {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+        }
+        self.cache.set(key, entry, timeout=settings.ORDER_RESPONSE_CACHE_TTL)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_orders(parties):
+    """
+    Drop cached responses for orders given as (user_id, delivery_man_id)
+    pairs, once the current transaction commits so readers cannot re-cache
+    the old rows in between.
+    """
+    scopes = [ALL_ORDERS]
+    for user_id, delivery_man_id in parties:
+        scopes.append(f"user:{user_id}")
+        if delivery_man_id is not None:
+            scopes.append(f"courier:{delivery_man_id}")
+    transaction.on_commit(lambda: response_cache.bump(*scopes))
+
+
+def cached_response(view_method):
+    """Serve a GET handler's 200 responses from the per-user response cache."""
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not settings.ORDER_RESPONSE_CACHE_TTL:
+            return view_method(self, request, *args, **kwargs)
+
+        key = response_cache.key(request)
+        entry = response_cache.get(key)
+        if entry is not None:
+            headers = entry['headers']
+            if 'ETag' in headers and is_not_modified(request, headers['ETag'], None):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            return Response(entry['data'], headers=headers)
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.set(key, response)
+        return response
+
+    return wrapper
@@ -0,0 +1,108 @@
+"""
+Revocation check for access tokens.
+
+Access tokens carry the ``jti`` of the refresh token they were minted from
+(``rjti``). Blacklisting that refresh token (logout, rotation, the
+``revoke_user_tokens`` command) revokes every access token of the session.
+
+Each process keeps the blacklisted jtis in a Bloom filter, synced
+incrementally from ``BlacklistedToken`` every TOKEN_REVOCATION_SYNC_SECONDS
+and rebuilt from the unexpired rows once full. A miss means "not revoked"
+without touching the database; a hit is confirmed with one lookup, so false
+positives never lock anyone out.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+REFRESH_JTI_CLAIM = 'rjti'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.filter = BloomFilter(settings.TOKEN_REVOCATION_CAPACITY)
+        self.last_id = 0
+        self.synced_at = None
+
+    def sync(self):
+        """Pull blacklist rows added since the last sync; rebuild when the filter is full."""
+        with self._lock:
+            if self.synced_at is None or self.filter.count >= self.filter.capacity:
+                # Full load: expired tokens cannot be presented anyway. Sized
+                # for the live tokens with as many again to spare, so a large
+                # blacklist does not refill the filter and force a rebuild on
+                # every sync
+                rows = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+                self.filter = BloomFilter(max(settings.TOKEN_REVOCATION_CAPACITY, 2 * rows.count()))
+            else:
+                rows = BlacklistedToken.objects.filter(id__gt=self.last_id)
+            for row_id, jti in rows.order_by('id').values_list('id', 'token__jti').iterator():
+                self.filter.add(jti)
+                self.last_id = max(self.last_id, row_id)
+            self.synced_at = time.monotonic()
+
+    def add(self, jti):
+        # Takes effect in this process at once, in the others on their next sync
+        with self._lock:
+            self.filter.add(jti)
+
+    def is_revoked(self, jti):
+        if self.synced_at is None or time.monotonic() - self.synced_at > settings.TOKEN_REVOCATION_SYNC_SECONDS:
+            self.sync()
+        if jti not in self.filter:
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+revocation_list = RevocationList()
+
+
+def session_jti(token):
+    """The jti that revokes ``token``: its refresh token's, or its own for older tokens."""
+    return token.get(REFRESH_JTI_CLAIM) or token.get(jwt_settings.JTI_CLAIM)
+
+
+def revoke_user_sessions(user):
+    """Blacklist every live refresh token of ``user``, revoking their access tokens too."""
+    outstanding = OutstandingToken.objects.filter(
+        user=user, expires_at__gt=timezone.now(), blacklistedtoken__isnull=True
+    )
+    revoked = 0
+    for token in outstanding:
+        BlacklistedToken.objects.get_or_create(token=token)
+        revoked += 1
+    # Also covers access tokens issued before they carried a refresh jti
+    user.revoke_tokens()
+    return revoked
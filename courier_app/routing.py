@@ -0,0 +1,200 @@
+"""
+Stop sequencing for a delivery man's open orders.
+
+Every PENDING order contributes a pickup and a delivery stop, picked up or
+in-transit orders only their delivery. The route starts at the courier's
+last reported location (see CourierLocation) and is built in two steps over
+a precomputed distance matrix:
+
+1. nearest neighbour: always drive to the closest stop that is allowed next,
+   a delivery only being allowed once its pickup is on the route;
+2. 2-opt: reverse route segments while that shortens the route, skipping
+   reversals that would put a delivery before its pickup.
+
+The path is open (it ends at the last stop); a zero-distance dummy end node
+lets 2-opt treat it like a tour. Plans are cached per courier until one of
+their open orders is added, removed or changed, or the courier reports a
+location outside the geohash cell the plan started from.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .dispatch import ACTIVE_STATUSES, geocode_orders
+from .geo import distance_matrix, geohash, np
+from .models import CourierLocation, Order
+
+PICKUP = 'pickup'
+DELIVERY = 'delivery'
+
+# Improvements smaller than this (km) do not count, so float noise cannot loop
+EPSILON = 1e-9
+
+# Geohash length of the start cell in the plan cache key (about 1.2 x 0.6 km):
+# moving within it keeps the plan, leaving it plans again
+START_CELL_PRECISION = 6
+
+
+def nearest_neighbour(distances, size, pickup_of):
+    """
+    Visiting order of nodes 1..size, starting from node 0. ``pickup_of``
+    maps each delivery node to its pickup node.
+    """
+    waiting = {}
+    for delivery, pickup in pickup_of.items():
+        waiting.setdefault(pickup, []).append(delivery)
+    ready = set(range(1, size + 1)) - set(pickup_of)
+    route, current = [0], 0
+    while ready:
+        current = min(ready, key=lambda node: (distances[current][node], node))
+        ready.remove(current)
+        ready.update(waiting.pop(current, ()))
+        route.append(current)
+    return route
+
+
+def reversal_limits(route, pickup_of):
+    """
+    For each position i, the first position a reversal starting at i may not
+    reach: the earliest delivery whose pickup sits at or after i.
+    """
+    position = {node: index for index, node in enumerate(route)}
+    limits = [len(route)] * (len(route) + 1)
+    for delivery, pickup in pickup_of.items():
+        limits[position[pickup]] = min(limits[position[pickup]], position[delivery])
+    for index in range(len(route) - 1, -1, -1):
+        limits[index] = min(limits[index], limits[index + 1])
+    return limits
+
+
+def two_opt(route, distances, pickup_of, deadline):
+    """Improve ``route`` (node 0 first, dummy end last) in place until no reversal helps."""
+    last = len(route) - 2  # last real stop
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        limits = reversal_limits(route, pickup_of)
+        for i in range(1, last):
+            # Reverse route[i..j] for j in i+1 .. min(limit, last)
+            end = min(limits[i] - 1, last)
+            if end <= i:
+                continue
+            if np is not None:
+                path = np.asarray(route)
+                js = np.arange(i + 1, end + 1)
+                a, b = path[i - 1], path[i]
+                delta = (
+                    distances[a, path[js]] + distances[b, path[js + 1]]
+                    - distances[a, b] - distances[path[js], path[js + 1]]
+                )
+                best = int(delta.argmin())
+                gain, j = float(delta[best]), int(js[best])
+            else:
+                a, b = route[i - 1], route[i]
+                gain, j = min(
+                    (
+                        distances[a][route[j]] + distances[b][route[j + 1]]
+                        - distances[a][b] - distances[route[j]][route[j + 1]],
+                        j,
+                    )
+                    for j in range(i + 1, end + 1)
+                )
+            if gain < -EPSILON:
+                route[i:j + 1] = route[i:j + 1][::-1]
+                limits = reversal_limits(route, pickup_of)
+                improved = True
+    return route
+
+
+def plan_route(start, stops, pickup_of):
+    """
+    Order ``stops`` [(lat, lng)] from ``start`` (lat, lng, or None to start
+    at any stop). ``pickup_of`` maps a delivery stop index to its pickup
+    stop index. Returns (stop indices in visiting order, km).
+    """
+    if not stops:
+        return [], 0.0
+    # Node 0 is the start, 1..n the stops, n + 1 the dummy end
+    size = len(stops)
+    distances = distance_matrix(stops, stops)
+    to_start = distance_matrix([start], stops)[0] if start is not None else [0.0] * size
+    if np is not None:
+        matrix = np.zeros((size + 2, size + 2))
+        matrix[1:-1, 1:-1] = distances
+        matrix[0, 1:-1] = matrix[1:-1, 0] = to_start
+    else:
+        matrix = [[0.0] * (size + 2) for _ in range(size + 2)]
+        for row in range(size):
+            matrix[0][row + 1] = matrix[row + 1][0] = to_start[row]
+            for column in range(size):
+                matrix[row + 1][column + 1] = distances[row][column]
+
+    nodes = {delivery + 1: pickup + 1 for delivery, pickup in pickup_of.items()}
+    # Plain lists are faster than NumPy for the scalar lookups here
+    route = nearest_neighbour(matrix.tolist() if np is not None else matrix, size, nodes) + [size + 1]
+    two_opt(route, matrix, nodes, time.perf_counter() + settings.ROUTE_TIME_BUDGET)
+
+    km = sum(float(matrix[a][b]) for a, b in zip(route, route[1:]))
+    return [node - 1 for node in route[1:-1]], km
+
+
+def assignment_signature(orders):
+    # updated_at also catches edited addresses
+    state = sorted((order['id'], order['status'], order['updated_at'].isoformat()) for order in orders)
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+def courier_route(courier):
+    """The planned stops for ``courier``'s open orders, cached until they change."""
+    orders = list(
+        Order.objects.filter(delivery_man=courier, status__in=ACTIVE_STATUSES).values(
+            'id', 'status', 'updated_at', 'pickup_address', 'pickup_lat', 'pickup_lng',
+            'delivery_address', 'delivery_lat', 'delivery_lng',
+        )
+    )
+    location = CourierLocation.objects.filter(courier=courier).values_list('lat', 'lng').first()
+    start_cell = geohash(*location, START_CELL_PRECISION) if location is not None else ''
+    key = f"route:{courier.pk}:{start_cell}:{assignment_signature(orders)}"
+    plan = cache.get(key)
+    if plan is not None:
+        return {**plan, 'cached': True}
+
+    pending = [order for order in orders if order['status'] == Order.StatusChoices.PENDING]
+    geocode_orders(pending, PICKUP)
+    geocode_orders(orders, DELIVERY)
+
+    stops, points, pickup_of, unrouted = [], [], {}, []
+    for order in orders:
+        needs_pickup = order['status'] == Order.StatusChoices.PENDING
+        if order['delivery_lat'] is None or (needs_pickup and order['pickup_lat'] is None):
+            unrouted.append(order['id'])
+            continue
+        if needs_pickup:
+            pickup_of[len(stops) + 1] = len(stops)
+            stops.append((order, PICKUP))
+            points.append((order['pickup_lat'], order['pickup_lng']))
+        stops.append((order, DELIVERY))
+        points.append((order['delivery_lat'], order['delivery_lng']))
+
+    sequence, km = plan_route(location, points, pickup_of)
+    plan = {
+        'stops': [
+            {
+                'order_id': stops[index][0]['id'],
+                'type': stops[index][1],
+                'address': stops[index][0][f'{stops[index][1]}_address'],
+                'lat': points[index][0],
+                'lng': points[index][1],
+            }
+            for index in sequence
+        ],
+        'distance_km': round(km, 3),
+        'unrouted': unrouted,
+    }
+    # Geocoding above stores coordinates and moves updated_at, so key the plan
+    # on the rows as they are now
+    key = f"route:{courier.pk}:{start_cell}:{assignment_signature(orders)}"
+    cache.set(key, plan, timeout=settings.ROUTE_CACHE_TTL)
+    return {**plan, 'cached': False}
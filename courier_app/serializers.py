@@ -1,9 +1,12 @@
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from django.contrib.auth.password_validation import validate_password
 from decimal import Decimal
 
-from .models import User, Order
+from .models import User, Order, OrderStatusEvent, PaymentJob, CourierLocation, ArchivedOrder
+from .authentication import ROLE_CLAIM, VERSION_CLAIM, SessionRefreshToken
+from .geo import geohash
+from .order_bulk import MAX_BULK_ORDERS
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -68,6 +71,10 @@ class OrderSerializer(serializers.ModelSerializer):
             'pickup_address',
             'delivery_address',
             'package_details',
+            'pickup_lat',
+            'pickup_lng',
+            'delivery_lat',
+            'delivery_lng',
             'total_amount',
             'status',
             'is_paid',
@@ -90,8 +97,98 @@ class OrderSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Total amount must be greater than 0.")
         return value
 
+    def validate(self, attrs):
+        for point in ('pickup', 'delivery'):
+            lat, lng = attrs.get(f'{point}_lat'), attrs.get(f'{point}_lng')
+            if (lat is None) != (lng is None):
+                raise serializers.ValidationError({f'{point}_lat': "Send both latitude and longitude."})
+            if lat is not None and not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise serializers.ValidationError({f'{point}_lat': "Coordinates are out of range."})
+        if attrs.get('pickup_lat') is not None:
+            attrs['pickup_geohash'] = geohash(attrs['pickup_lat'], attrs['pickup_lng'])
+        elif self.instance is not None and attrs.get('pickup_address', self.instance.pickup_address) != (
+            self.instance.pickup_address
+        ):
+            # Moved pickup without coordinates: geocode it again at dispatch
+            attrs.update(pickup_lat=None, pickup_lng=None, pickup_geohash='')
+        return attrs
+
+
+class CourierLocationSerializer(serializers.ModelSerializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+
+    class Meta:
+        model = CourierLocation
+        fields = ['lat', 'lng', 'is_available', 'updated_at']
+        read_only_fields = ['updated_at']
+
+
+class OrderStatusEventSerializer(serializers.ModelSerializer):
+    changed_by = serializers.StringRelatedField()
+
+    class Meta:
+        model = OrderStatusEvent
+        fields = ['from_status', 'to_status', 'changed_by', 'created_at']
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    """Read-only: an archived order rendered like OrderSerializer renders a live one."""
+    user = serializers.StringRelatedField()
+    delivery_man = serializers.StringRelatedField()
+
+    class Meta:
+        model = ArchivedOrder
+        fields = [field for field in OrderSerializer.Meta.fields if field != 'delivery_man_id'] + ['archived_at']
+        read_only_fields = fields
+
+
+class OrderImportSerializer(OrderSerializer):
+    # Resolved for a whole chunk at once by courier_app.order_import
+    delivery_man_id = serializers.IntegerField(required=False, allow_null=True, write_only=True)
+
+
+class BulkOrderSerializer(serializers.Serializer):
+    order_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_ORDERS,
+    )
+
+    def validate_order_ids(self, value):
+        # Keep the caller's order for the per-order results, drop repeats
+        return list(dict.fromkeys(value))
+
+
+class BulkAssignSerializer(BulkOrderSerializer):
+    delivery_man_id = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.filter(role=User.Roles.DELIVERY_MAN),
+        source='delivery_man',
+    )
+
+
+class BulkStatusSerializer(BulkOrderSerializer):
+    status = serializers.ChoiceField(choices=Order.StatusChoices.choices)
+
+
+class PaymentJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentJob
+        fields = ['id', 'order', 'status', 'client_secret', 'attempts', 'last_error', 'created_at', 'updated_at']
+        read_only_fields = fields
+
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = SessionRefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Lets StatelessJWTAuthentication serve reads without loading the user
+        token[ROLE_CLAIM] = user.role
+        token[VERSION_CLAIM] = user.token_version
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
 
@@ -108,3 +205,15 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
                 }
             
         }
+
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = SessionRefreshToken
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        if 'refresh' in data:
+            # The parent minted the access token before rotating, from the
+            # refresh token it just blacklisted; mint it from the new one
+            data['access'] = str(self.token_class(data['refresh'], verify=False).access_token)
+        return data
@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .analytics import ROLLUP_FIELDS, record_changes, rollup_values, stored_values
+from .archive import archiving
+from .authentication import remember_token_version
+from .models import ArchivedOrder, Order, User
+from .response_cache import invalidate_orders
+from .revocation import revocation_list
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_cached_order_responses(sender, instance, **kwargs):
+    if archiving.get():
+        return  # archive_batch() invalidates the whole batch at once
+    parties = [(instance.user_id, instance.delivery_man_id)]
+    previous_courier = getattr(instance, '_loaded_values', {}).get('delivery_man_id')
+    if previous_courier != instance.delivery_man_id:
+        # The order also left the previous delivery man's list
+        parties.append((instance.user_id, previous_courier))
+    invalidate_orders(parties)
+
+
+@receiver(post_save, sender=Order)
+def record_order_stats(sender, instance, created, **kwargs):
+    before = None if created else stored_values(instance)
+    record_changes([(before, rollup_values(instance))])
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_stats(sender, instance, **kwargs):
+    if archiving.get():
+        return  # archived orders keep counting
+    record_changes([(stored_values(instance), None)])
+
+
+@receiver(pre_delete, sender=User)
+def record_user_order_stats(sender, instance, **kwargs):
+    """
+    Deleting a user rewrites orders without per-order signals: SET_NULL
+    unassigns the orders they deliver and CASCADE drops their archived ones.
+    Their live orders are deleted one by one and recorded above.
+    """
+    changes = []
+    for model in (Order, ArchivedOrder):
+        carried = model.objects.filter(delivery_man=instance).exclude(user=instance)
+        changes += [(order, {**order, 'delivery_man_id': None}) for order in carried.values(*ROLLUP_FIELDS)]
+    changes += [(order, None) for order in ArchivedOrder.objects.filter(user=instance).values(*ROLLUP_FIELDS)]
+    record_changes(changes)
+    invalidate_orders(
+        (user_id, instance.pk)
+        for user_id in Order.objects.filter(delivery_man=instance).values_list('user_id', flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=User)
+def publish_token_version(sender, instance, **kwargs):
+    # Read requests compare token claims against this cached version
+    transaction.on_commit(lambda: remember_token_version(instance))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def revoke_session(sender, instance, created, **kwargs):
+    # Other processes pick the row up on their next revocation sync
+    if created:
+        jti = instance.token.jti
+        transaction.on_commit(lambda: revocation_list.add(jti))
@@ -1,3 +1,1449 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import random
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import analytics, dispatch, routing
+from .archive import archive_orders
+from .metrics import TimedStripeClient, registry
+from .authentication import version_key
+from .geo import geohash, haversine_km, neighbours
+from .models import ArchivedOrder, CourierLocation, User, Order, OrderStat, OrderStatusEvent, PaymentJob, StripeEvent
+from .order_bulk import bulk_assign, bulk_transition
+from .payments import PAYMENT_SUCCEEDED, intent_cache, process_pending_jobs, process_stripe_events
+from .realtime import get_broker, user_channel
+from .response_cache import response_cache
+from .revocation import BloomFilter, RevocationList, revocation_list
+from .throttling import CacheBucketStore, LocalMemoryBucketStore, get_bucket_store
+from .serializers import CustomTokenObtainPairSerializer
+from .views import OrderViewSet, UserOrderStatusView
+
+
+# Throttling is covered by RoleThrottleTestCase with the configured rates;
+# everywhere else bursts of test requests must not run into 429s
+THROTTLED = settings.REST_FRAMEWORK
+unthrottled = override_settings(REST_FRAMEWORK={**THROTTLED, 'DEFAULT_THROTTLE_RATES': {}})
+
+
+def setUpModule():
+    unthrottled.enable()
+
+
+def tearDownModule():
+    unthrottled.disable()
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=0)
+class QueryBudgetTestCase(TestCase):
+    """
+    Enforces the ``query_budget`` that order views declare.
+
+    Every endpoint is exercised with a small and a large number of orders; the
+    query count must stay within the budget and must not grow with the rows.
+    Budgets cover the uncached path, so the response cache is off here.
+    """
+
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        self.client = APIClient()
+
+    def create_orders(self, count):
+        Order.objects.bulk_create(
+            Order(
+                user=self.customer,
+                delivery_man=self.courier,
+                pickup_address='Pickup',
+                delivery_address='Drop',
+                total_amount=10,
+            )
+            for _ in range(count)
+        )
+
+    def assertWithinQueryBudget(self, view, key, user, url):
+        budget = view.query_budget[key]
+        self.client.force_authenticate(user)
+        counts = []
+        for count in (1, 40):
+            self.create_orders(count)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+            self.assertLessEqual(
+                len(queries), budget,
+                f"{view.__name__}.{key} ran {len(queries)} queries, budget is {budget}",
+            )
+        self.assertEqual(counts[0], counts[1], f"{view.__name__}.{key} query count grows with rows")
+
+    def test_order_list(self):
+        self.assertWithinQueryBudget(OrderViewSet, 'list', self.admin, '/api/v1/orders/')
+
+    def test_order_retrieve(self):
+        self.create_orders(1)
+        order = Order.objects.first()
+        self.assertWithinQueryBudget(OrderViewSet, 'retrieve', self.customer, f'/api/v1/orders/{order.id}/')
+
+    def test_assigned_orders(self):
+        self.assertWithinQueryBudget(OrderViewSet, 'assigned', self.courier, '/api/v1/orders/assigned/')
+
+    def test_user_order_status(self):
+        self.assertWithinQueryBudget(UserOrderStatusView, 'get', self.customer, '/api/v1/orders/status/')
+
+    def test_order_history(self):
+        budget = OrderViewSet.query_budget['history']
+        self.client.force_authenticate(self.admin)
+        order = Order.objects.create(user=self.customer, delivery_man=self.courier, pickup_address='A', delivery_address='B')
+        counts = []
+        for step in ('PICKED', 'IN_TRANSIT', 'DELIVERED'):
+            # A different user records each change
+            order.transition_to(step, by=User.objects.create(username=f'by-{step}'))
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f'/api/v1/orders/{order.id}/history/')
+            counts.append(len(queries))
+        self.assertLessEqual(max(counts), budget)
+        self.assertEqual(len(set(counts)), 1, "OrderViewSet.history query count grows with events")
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=0)
+class OrderPaginationTestCase(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        self.client = APIClient()
+
+    def create_orders(self, count, created_at):
+        Order.objects.bulk_create(
+            Order(
+                user=self.customer, delivery_man=self.courier, pickup_address='A', delivery_address='B',
+                total_amount=5, created_at=created_at,
+            )
+            for _ in range(count)
+        )
+
+    def walk(self, url, page):
+        """Order ids across every page forwards, then backwards again, following the cursors."""
+        forwards, pages = [], []
+        while url:
+            body = page(self.client.get(url))
+            pages.append(body)
+            forwards.extend(order['id'] for order in body['results'])
+            url = body['next']
+        backwards = []
+        url = pages[-1]['previous']
+        while url:
+            body = page(self.client.get(url))
+            backwards[:0] = [order['id'] for order in body['results']]
+            url = body['previous']
+        return forwards, backwards + [order['id'] for order in pages[-1]['results']]
+
+    def test_pages_are_stable_across_equal_timestamps(self):
+        now = timezone.now()
+        # Seven orders share one instant, so the id tiebreak and the cursor offset are exercised
+        self.create_orders(2, now)
+        self.create_orders(7, now - timedelta(minutes=1))
+        self.create_orders(2, now - timedelta(minutes=2))
+        expected = list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        self.client.force_authenticate(self.admin)
+        forwards, backwards = self.walk('/api/v1/orders/?page_size=3', lambda response: response.json())
+        self.assertEqual(forwards, expected)
+        self.assertEqual(backwards, expected)
+
+        self.client.force_authenticate(self.courier)
+        forwards, backwards = self.walk('/api/v1/orders/assigned/?page_size=3', lambda response: response.json()['Data'])
+        self.assertEqual(forwards, expected)
+        self.assertEqual(backwards, expected)
+
+    def test_page_size_is_capped(self):
+        self.create_orders(201, timezone.now())
+        self.client.force_authenticate(self.admin)
+
+        body = self.client.get('/api/v1/orders/?page_size=500').json()
+
+        self.assertEqual(len(body['results']), 200)
+        self.assertIsNotNone(body['next'])
+        self.assertEqual(len(self.client.get('/api/v1/orders/').json()['results']), 50)
+
+
+@mock.patch('courier_app.payments.stripe.PaymentIntent')
+class PaymentJobTestCase(TestCase):
+    def setUp(self):
+        caches['payment_intents'].clear()
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.order = Order.objects.create(
+            user=self.customer, pickup_address='Pickup', delivery_address='Drop', total_amount=12
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.url = f'/api/v1/orders/{self.order.id}/pay/'
+
+    def test_pay_queues_job_without_calling_stripe(self, intents):
+        response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['Data']['status'], PaymentJob.StatusChoices.PENDING)
+        intents.create.assert_not_called()
+
+        # A retry while the job is queued reuses it
+        self.client.post(self.url)
+        self.assertEqual(PaymentJob.objects.count(), 1)
+
+    def test_worker_stores_intent_for_polling(self, intents):
+        intents.create.return_value = SimpleNamespace(id='pi_123', client_secret='secret_123')
+        self.client.post(self.url)
+
+        self.assertEqual(process_pending_jobs(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.stripe_payment_intent, 'pi_123')
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['Data']['client_secret'], 'secret_123')
+        intents.create.assert_called_once()
+
+    def test_existing_intent_is_served_from_cache(self, intents):
+        intents.retrieve.return_value = SimpleNamespace(id='pi_123', client_secret='secret_123', status='requires_payment_method')
+        Order.objects.filter(id=self.order.id).update(stripe_payment_intent='pi_123')
+
+        with self.settings(PAYMENT_JOBS_EAGER=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url)
+            PaymentJob.objects.all().delete()
+            response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['Data']['client_secret'], 'secret_123')
+        intents.retrieve.assert_called_once()
+        self.assertGreaterEqual(intent_cache.stats()['hits'], 1)
+
+    def test_order_and_job_are_written_before_stripe_is_called(self, intents):
+        intents.create.return_value = SimpleNamespace(id='pi_new', client_secret='secret_new')
+        data = {'pickup_address': 'A', 'delivery_address': 'B', 'total_amount': '9.50', 'pay_now': True}
+
+        with self.settings(PAYMENT_JOBS_EAGER=True):
+            with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/v1/orders/', data, format='json')
+            writes = [
+                query['sql'].split()[0] for query in queries
+                if query['sql'].startswith(('INSERT INTO "courier_app_order"', 'UPDATE "courier_app_order"'))
+            ]
+            self.assertEqual(writes, ['INSERT'])
+            self.assertEqual(response.json()['Data']['payment']['status'], PaymentJob.StatusChoices.PENDING)
+            intents.create.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+
+        intents.create.assert_called_once()
+        order = Order.objects.get(id=response.json()['Data']['id'])
+        self.assertEqual(order.stripe_payment_intent, 'pi_new')
+
+    def test_invalid_amount_writes_nothing(self, intents):
+        response = self.client.post(
+            '/api/v1/orders/', {'pickup_address': 'A', 'delivery_address': 'B', 'total_amount': '0'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_stripe_errors_are_retried_then_failed(self, intents):
+        intents.create.side_effect = stripe.error.APIConnectionError('network down')
+        self.client.post(self.url)
+
+        with self.settings(PAYMENT_JOB_MAX_ATTEMPTS=1):
+            process_pending_jobs()
+        job = PaymentJob.objects.get()
+        self.assertEqual(job.status, PaymentJob.StatusChoices.FAILED)
+        self.assertEqual(self.client.get(self.url).status_code, 502)
+
+    def test_new_job_after_failure_gets_its_own_idempotency_key(self, intents):
+        intents.create.side_effect = stripe.error.APIConnectionError('network down')
+        self.client.post(self.url)
+        with self.settings(PAYMENT_JOB_MAX_ATTEMPTS=1):
+            process_pending_jobs()
+
+        intents.create.side_effect = None
+        intents.create.return_value = SimpleNamespace(id='pi_123', client_secret='secret_123')
+        self.client.post(self.url)
+        process_pending_jobs()
+
+        keys = [call.kwargs['idempotency_key'] for call in intents.create.call_args_list]
+        self.assertEqual(keys, [f'payment-job-{job.id}' for job in PaymentJob.objects.order_by('id')])
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_unexpected_errors_reschedule_the_job(self, intents):
+        intents.create.side_effect = TypeError('unexpected')
+        self.client.post(self.url)
+
+        with self.assertLogs('courier_app.payments', 'ERROR'):
+            process_pending_jobs()
+
+        job = PaymentJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.last_error), (PaymentJob.StatusChoices.PENDING, 1, 'unexpected'))
+        self.assertGreater(job.run_after, timezone.now())
+
+    def test_abandoned_jobs_fail_once_out_of_attempts(self, intents):
+        self.client.post(self.url)
+        # A worker died during the last allowed attempt
+        PaymentJob.objects.update(
+            status=PaymentJob.StatusChoices.RUNNING, attempts=5, updated_at=timezone.now() - timedelta(hours=1)
+        )
+
+        with self.settings(PAYMENT_JOB_MAX_ATTEMPTS=5):
+            self.assertEqual(process_pending_jobs(), 0)
+
+        self.assertEqual(PaymentJob.objects.get().status, PaymentJob.StatusChoices.FAILED)
+        intents.create.assert_not_called()
+
+
+class IdempotencyKeyTestCase(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.payload = {'pickup_address': 'Pickup', 'delivery_address': 'Drop', 'total_amount': '15.00'}
+
+    def test_retry_replays_first_response(self):
+        first = self.client.post('/api/v1/orders/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        retry = self.client.post('/api/v1/orders/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reuse_with_different_body_is_rejected(self):
+        self.client.post('/api/v1/orders/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        other = dict(self.payload, total_amount='99.00')
+        response = self.client.post('/api/v1/orders/', other, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_validation_can_be_retried(self):
+        invalid = dict(self.payload, total_amount='0')
+        self.client.post('/api/v1/orders/', invalid, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.client.post('/api/v1/orders/', invalid, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTestCase(TestCase):
+    url = '/api/v1/payments/stripe/webhook/'
+
+    def setUp(self):
+        customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.order = Order.objects.create(
+            user=customer, pickup_address='Pickup', delivery_address='Drop',
+            total_amount=12, stripe_payment_intent='pi_123',
+        )
+
+    def send(self, event_id, event_type='payment_intent.succeeded', secret='whsec_test'):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': event_type,
+            'data': {'object': {'id': 'pi_123', 'object': 'payment_intent'}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            self.url, payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f"t={timestamp},v1={signature}",
+        )
+
+    def test_succeeded_event_marks_order_paid(self):
+        self.assertEqual(self.send('evt_1').status_code, 200)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_paid)
+
+    def test_redelivered_event_is_stored_once(self):
+        self.send('evt_1')
+        self.send('evt_1')
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_bad_signature_is_rejected(self):
+        self.assertEqual(self.send('evt_1', secret='whsec_wrong').status_code, 400)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+
+
+class OrderImportTestCase(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_csv_upload_reports_row_errors(self):
+        csv_file = SimpleUploadedFile('orders.csv', (
+            "pickup_address,delivery_address,total_amount,delivery_man_id\n"
+            f"A,B,10.00,{self.courier.id}\n"
+            "A,B,0,\n"
+            f"A,B,5.00,{self.customer.id}\n"
+            "A,B,7.50,\n"
+        ).encode())
+        response = self.client.post('/api/v1/orders/import/', {'file': csv_file}, format='multipart')
+
+        data = response.json()['Data']
+        self.assertEqual((data['created'], data['failed']), (2, 2))
+        self.assertEqual([error['row'] for error in data['errors']], [2, 3])
+        self.assertEqual(Order.objects.filter(user=self.customer, delivery_man=self.courier).count(), 1)
+
+    def test_jsonl_body_uses_constant_queries_per_chunk(self):
+        body = "\n".join(
+            json.dumps({'pickup_address': 'A', 'delivery_address': 'B', 'total_amount': '3.00', 'delivery_man_id': self.courier.id})
+            for _ in range(200)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/v1/orders/import/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.json()['Data']['created'], 200)
+        self.assertLess(len(queries), 10)
+
+
+class OrderExportTestCase(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        other = User.objects.create(username='other', role=User.Roles.USER)
+        self.orders = [
+            Order.objects.create(user=owner, pickup_address='A', delivery_address='B', total_amount=5)
+            for owner in (self.customer, other, self.customer, self.customer)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def export(self, query):
+        response = self.client.get(f'/api/v1/orders/export/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_jsonl_export_is_scoped_and_resumable(self):
+        rows = [json.loads(line) for line in self.export('file_format=jsonl').splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.orders[i].id for i in (0, 2, 3)])
+        self.assertEqual(rows[0]['user'], 'customer')
+
+        resumed = [json.loads(line) for line in self.export(f'file_format=jsonl&after={rows[0]["id"]}').splitlines()]
+        self.assertEqual([row['id'] for row in resumed], [self.orders[i].id for i in (2, 3)])
+
+    def test_csv_export_has_header(self):
+        lines = self.export('file_format=csv').splitlines()
+        self.assertTrue(lines[0].startswith('id,user,delivery_man'))
+        self.assertEqual(len(lines), 4)
+
+
+class BulkDispatchTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.orders = [
+            Order.objects.create(user=customer, pickup_address='A', delivery_address='B', total_amount=5)
+            for _ in range(3)
+        ]
+        self.client = APIClient()
+
+    def test_bulk_assign_then_courier_bulk_status(self):
+        ids = [order.id for order in self.orders]
+        self.client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/v1/orders/bulk-assign/',
+                {'order_ids': ids[:2] + [999], 'delivery_man_id': self.courier.id},
+                format='json',
+            )
+        self.assertEqual(response.json()['Data']['updated'], 2)
+        self.assertEqual(response.json()['Data']['results'][-1], {'id': 999, 'result': 'not_found'})
+        self.assertLess(len(queries), 8)
+
+        self.client.force_authenticate(self.courier)
+        response = self.client.post('/api/v1/orders/bulk-status/', {'order_ids': ids, 'status': 'PICKED'}, format='json')
+        results = [row['result'] for row in response.json()['Data']['results']]
+        self.assertEqual(results, ['updated', 'updated', 'not_found'])
+        self.assertEqual(Order.objects.filter(status='PICKED').count(), 2)
+
+    def test_bulk_assign_skips_finished_orders_and_tells_the_previous_courier(self):
+        previous = User.objects.create(username='previous', role=User.Roles.DELIVERY_MAN)
+        Order.objects.filter(id=self.orders[0].id).update(delivery_man=previous)
+        Order.objects.filter(id=self.orders[1].id).update(delivery_man=previous, status=Order.StatusChoices.DELIVERED)
+        self.client.force_authenticate(self.admin)
+
+        with mock.patch('courier_app.realtime.InMemoryBroker.publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    '/api/v1/orders/bulk-assign/',
+                    {'order_ids': [self.orders[0].id, self.orders[1].id], 'delivery_man_id': self.courier.id},
+                    format='json',
+                )
+
+        results = [row['result'] for row in response.json()['Data']['results']]
+        self.assertEqual(results, ['assigned', 'invalid_status'])
+        self.assertEqual(Order.objects.get(id=self.orders[1].id).delivery_man, previous)
+        channels = {call.args[0] for call in publish.call_args_list}
+        self.assertEqual(
+            channels,
+            {user_channel(self.orders[0].user_id), user_channel(self.courier.id), user_channel(previous.id)},
+        )
+
+    def test_bulk_assign_is_admin_only(self):
+        self.client.force_authenticate(self.courier)
+        response = self.client.post(
+            '/api/v1/orders/bulk-assign/',
+            {'order_ids': [self.orders[0].id], 'delivery_man_id': self.courier.id},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class OrderStatusTransitionTestCase(TestCase):
+    def setUp(self):
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.order = Order.objects.create(
+            user=customer, delivery_man=self.courier, pickup_address='A', delivery_address='B', total_amount=5
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.courier)
+        self.url = f'/api/v1/orders/{self.order.id}/'
+
+    def test_courier_follows_transition_graph(self):
+        self.assertEqual(self.client.patch(self.url, {'status': 'DELIVERED'}, format='json').status_code, 400)
+        self.assertEqual(self.client.patch(self.url, {'status': 'PICKED'}, format='json').status_code, 200)
+
+        history = self.client.get(f'{self.url}history/').json()['Data']
+        self.assertEqual([(e['from_status'], e['to_status']) for e in history], [('PENDING', 'PICKED')])
+
+    def test_bulk_status_reports_invalid_transitions(self):
+        response = self.client.post(
+            '/api/v1/orders/bulk-status/', {'order_ids': [self.order.id], 'status': 'COMPLETE'}, format='json'
+        )
+        self.assertEqual(response.json()['Data']['results'], [{'id': self.order.id, 'result': 'invalid_transition'}])
+        self.assertFalse(OrderStatusEvent.objects.exists())
+
+    def test_events_are_append_only(self):
+        self.order.transition_to(Order.StatusChoices.PICKED, by=self.courier)
+        event = OrderStatusEvent.objects.get()
+        with self.assertRaises(ValueError):
+            event.save()
+
+
+class OrderEventStreamTestCase(TestCase):
+    def setUp(self):
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.order = Order.objects.create(
+            user=customer, delivery_man=self.courier, pickup_address='A', delivery_address='B', total_amount=5
+        )
+
+    def stream_token(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return client.post('/api/v1/orders/events/token/').json()['Data']['token']
+
+    async def test_stream_delivers_published_changes(self):
+        token = await sync_to_async(self.stream_token)(self.courier)
+        response = await self.async_client.get('/api/v1/orders/events/', {'token': token})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b': connected\n\n')
+        get_broker().publish(user_channel(self.courier.id), json.dumps({'order_id': self.order.id}))
+        self.assertEqual(await anext(stream), f'event: order\ndata: {{"order_id": {self.order.id}}}\n\n'.encode())
+        await stream.aclose()
+
+    async def test_stream_requires_token(self):
+        response = await self.async_client.get('/api/v1/orders/events/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_access_tokens_are_not_accepted_in_the_url(self):
+        token = str(AccessToken.for_user(self.courier))
+        response = await self.async_client.get('/api/v1/orders/events/', {'token': token})
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.async_client.get('/api/v1/orders/events/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        await response.streaming_content.aclose()
+
+    def test_stream_needs_asgi(self):
+        response = self.client.get('/api/v1/orders/events/')
+        self.assertEqual(response.status_code, 501)
+
+    @override_settings(WEB_CONCURRENCY=4)
+    async def test_process_local_broker_refuses_several_processes(self):
+        with self.assertLogs('courier_app.views', 'ERROR'):
+            response = await self.async_client.get('/api/v1/orders/events/')
+        self.assertEqual(response.status_code, 503)
+
+    def test_commands_warn_when_their_changes_are_not_streamed(self):
+        with self.assertLogs('courier_app.management.commands.dispatch_orders', 'WARNING') as logs:
+            call_command('dispatch_orders', stdout=mock.Mock())
+        self.assertIn('not streamed', logs.output[0])
+
+    def test_transition_is_published_to_owner_and_courier(self):
+        with mock.patch('courier_app.realtime.InMemoryBroker.publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.order.transition_to(Order.StatusChoices.PICKED, by=self.courier)
+        channels = {call.args[0] for call in publish.call_args_list}
+        self.assertEqual(channels, {user_channel(self.order.user_id), user_channel(self.courier.id)})
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        caches['order_responses'].clear()
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.order = Order.objects.create(user=self.customer, pickup_address='A', delivery_address='B', total_amount=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_unchanged_collection_returns_304_without_serializing(self):
+        etag = self.client.get('/api/v1/orders/status/')['ETag']
+        with mock.patch('courier_app.views.OrderSerializer.to_representation') as to_representation:
+            response = self.client.get('/api/v1/orders/status/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        to_representation.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.transition_to(Order.StatusChoices.PICKED)
+        self.assertEqual(self.client.get('/api/v1/orders/status/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_single_order_honours_if_modified_since(self):
+        url = f'/api/v1/orders/{self.order.id}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_collection_ignores_if_modified_since(self):
+        newest = self.client.get(f'/api/v1/orders/{self.order.id}/')['Last-Modified']
+        older = Order.objects.create(user=self.customer, pickup_address='C', delivery_address='D', total_amount=5)
+        Order.objects.filter(pk=older.pk).update(updated_at=self.order.updated_at - timedelta(hours=1))
+        first = self.client.get('/api/v1/orders/status/')
+        self.assertNotIn('Last-Modified', first)
+
+        # Deleting an older order leaves max(updated_at) where it was
+        older.delete()
+        response = self.client.get('/api/v1/orders/status/', HTTP_IF_MODIFIED_SINCE=newest)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_list_etag_depends_on_query_string(self):
+        first = self.client.get('/api/v1/orders/?page_size=1')['ETag']
+        self.assertNotEqual(first, self.client.get('/api/v1/orders/?page_size=2')['ETag'])
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=300)
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        caches['order_responses'].clear()
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.order = Order.objects.create(
+            user=self.customer, delivery_man=self.courier, pickup_address='A', delivery_address='B', total_amount=5
+        )
+        self.client = APIClient()
+
+    def test_repeated_reads_skip_the_database(self):
+        self.client.force_authenticate(self.customer)
+        first = self.client.get('/api/v1/orders/')
+        hits = response_cache.hits
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get('/api/v1/orders/')
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(response_cache.hits, hits + 1)
+
+    def test_writes_invalidate_owner_and_courier(self):
+        self.client.force_authenticate(self.courier)
+        self.client.get('/api/v1/orders/assigned/')
+        self.client.force_authenticate(self.customer)
+        self.client.get('/api/v1/orders/status/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.transition_to(Order.StatusChoices.PICKED)
+
+        status_page = self.client.get('/api/v1/orders/status/').json()
+        self.assertEqual(status_page['results'][0]['status'], 'PICKED')
+        self.client.force_authenticate(self.courier)
+        assigned = self.client.get('/api/v1/orders/assigned/').json()['Data']
+        self.assertEqual(assigned['results'][0]['status'], 'PICKED')
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=0)
+@override_settings(TOKEN_VERSION_CACHE_TTL=300)
+class StatelessAuthenticationTestCase(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.client = APIClient()
+
+    def authorize(self, user):
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def user_queries(self, queries):
+        return [query for query in queries if 'FROM "courier_app_user"' in query['sql']]
+
+    def test_reads_skip_the_user_query(self):
+        self.authorize(self.courier)
+        self.client.get('/api/v1/orders/assigned/')  # first request caches the version
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/orders/assigned/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.user_queries(queries), [])
+
+    def test_writes_load_the_user(self):
+        self.authorize(self.courier)
+        self.client.get('/api/v1/orders/assigned/')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch('/api/v1/profile/', {'email': 'c@example.com'}, format='json')
+
+        self.assertTrue(self.user_queries(queries))
+
+    def test_profile_is_loaded_in_full(self):
+        self.courier.email = 'courier@example.com'
+        self.courier.save()
+        self.authorize(self.courier)
+        self.client.get('/api/v1/orders/assigned/')
+
+        response = self.client.get('/api/v1/profile/')
+
+        self.assertEqual(response.json()['Data']['email'], 'courier@example.com')
+
+    def test_role_change_revokes_tokens(self):
+        self.authorize(self.courier)
+        self.assertEqual(self.client.get('/api/v1/orders/assigned/').status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.courier.role = User.Roles.USER
+            self.courier.save()
+
+        self.assertEqual(caches['default'].get(version_key(self.courier.pk)), 1)
+        self.assertEqual(self.client.get('/api/v1/orders/assigned/').status_code, 401)
+
+    def test_unknown_version_falls_back_to_database(self):
+        self.authorize(self.courier)
+        caches['default'].clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/v1/orders/assigned/').status_code, 200)
+
+        self.assertEqual(len(self.user_queries(queries)), 1)
+        self.assertEqual(caches['default'].get(version_key(self.courier.pk)), 0)
+
+    @override_settings(TOKEN_VERSION_CACHE_TTL=0)
+    def test_reads_load_the_user_without_a_shared_cache(self):
+        self.authorize(self.courier)
+        self.client.get('/api/v1/orders/assigned/')
+        # Another worker demoted the courier; this process never heard of it
+        User.objects.filter(pk=self.courier.pk).update(role=User.Roles.USER, token_version=1)
+
+        self.assertIsNone(caches['default'].get(version_key(self.courier.pk)))
+        self.assertEqual(self.client.get('/api/v1/orders/assigned/').status_code, 401)
+
+
+@override_settings(
+    ORDER_RESPONSE_CACHE_TTL=0, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+class TokenRevocationTestCase(TestCase):
+    def setUp(self):
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.courier.set_password('Pass12345!')
+        self.courier.save()
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/api/v1/login/', {'username': 'courier', 'password': 'Pass12345!'})
+        return response.json()['Data']
+
+    def get_assigned(self, access):
+        return self.client.get('/api/v1/orders/assigned/', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_refresh_rotates_and_retires_the_old_token(self):
+        tokens = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            rotated = self.client.post('/api/v1/token/refresh/', {'refresh': tokens['refresh']}).json()
+
+        self.assertNotEqual(rotated['refresh'], tokens['refresh'])
+        self.assertEqual(self.get_assigned(rotated['access']).status_code, 200)
+        self.assertEqual(self.client.post('/api/v1/token/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+        # Access tokens of the retired refresh token are revoked with it
+        self.assertEqual(self.get_assigned(tokens['access']).status_code, 401)
+
+    def test_logout_revokes_the_session_access_token(self):
+        tokens = self.login()
+        self.assertEqual(self.get_assigned(tokens['access']).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/logout/', {'refresh': tokens['refresh']})
+
+        self.assertEqual(self.get_assigned(tokens['access']).status_code, 401)
+
+    def test_command_revokes_every_session(self):
+        sessions = [self.login(), self.login()]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('revoke_user_tokens', 'courier', '--deactivate', stdout=mock.Mock())
+
+        for tokens in sessions:
+            self.assertEqual(self.get_assigned(tokens['access']).status_code, 401)
+        self.assertFalse(User.objects.get(pk=self.courier.pk).is_active)
+
+    def test_unrevoked_tokens_are_checked_without_queries(self):
+        revocation_list.sync()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(revocation_list.is_revoked('not-revoked'))
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(TOKEN_REVOCATION_CAPACITY=2)
+    def test_filter_grows_past_its_capacity(self):
+        outstanding = OutstandingToken.objects.bulk_create(
+            OutstandingToken(user=self.courier, jti=f'jti-{i}', token='t', expires_at=timezone.now() + timedelta(days=1))
+            for i in range(5)
+        )
+        BlacklistedToken.objects.bulk_create(BlacklistedToken(token=token) for token in outstanding)
+        revocation = RevocationList()
+
+        revocation.sync()
+        rebuilt = revocation.filter
+        revocation.sync()
+
+        self.assertIs(revocation.filter, rebuilt)
+        self.assertGreaterEqual(rebuilt.capacity, 10)
+        self.assertTrue(revocation.is_revoked('jti-4'))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        items = [f'jti-{i}' for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], LOGIN_MAX_FAILURES_PER_USERNAME=3
+)
+class LoginThrottleTestCase(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = User.objects.create_user(username='customer', password='Pass12345!')
+        self.client = APIClient()
+
+    def login(self, password):
+        return self.client.post('/api/v1/login/', {'username': 'customer', 'password': password})
+
+    def test_repeated_failures_are_refused_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.login('wrong').status_code, 401)
+
+        with mock.patch('django.contrib.auth.backends.ModelBackend.authenticate') as authenticate:
+            response = self.login('Pass12345!')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        authenticate.assert_not_called()
+
+    def test_success_clears_the_username_counter(self):
+        self.login('wrong')
+        self.login('wrong')
+        self.assertEqual(self.login('Pass12345!').status_code, 200)
+
+        self.login('wrong')
+        self.login('wrong')
+        self.assertEqual(self.login('Pass12345!').status_code, 200)
+
+    @override_settings(LOGIN_MAX_FAILURES_PER_IP=3)
+    def test_forged_forwarded_for_does_not_reset_the_ip_counter(self):
+        for attempt in range(3):
+            response = self.client.post(
+                '/api/v1/login/', {'username': f'user{attempt}', 'password': 'wrong'},
+                HTTP_X_FORWARDED_FOR=f'203.0.113.{attempt}',
+            )
+            self.assertEqual(response.status_code, 401)
+
+        response = self.client.post(
+            '/api/v1/login/', {'username': 'user9', 'password': 'wrong'}, HTTP_X_FORWARDED_FOR='203.0.113.9'
+        )
+        self.assertEqual(response.status_code, 429)
+
+    def test_missing_fields_are_a_bad_request(self):
+        response = self.client.post('/api/v1/login/', {'username': 'customer'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_hash_upgrade_on_login_keeps_tokens_valid(self):
+        hashers = ['django.contrib.auth.hashers.PBKDF2PasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher']
+        with override_settings(PASSWORD_HASHERS=hashers):
+            self.assertEqual(self.login('Pass12345!').status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(self.user.token_version, 0)
+
+
+@override_settings(
+    ORDER_RESPONSE_CACHE_TTL=0,
+    THROTTLE_BUCKET_STORE='courier_app.throttling.LocalMemoryBucketStore',
+    REST_FRAMEWORK=THROTTLED,
+)
+class RoleThrottleTestCase(TestCase):
+    def setUp(self):
+        get_bucket_store().clear()
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        self.client = APIClient()
+
+    def burst(self, user, count):
+        self.client.force_authenticate(user)
+        return [self.client.get('/api/v1/orders/').status_code for _ in range(count)]
+
+    def test_customer_bucket_empties_after_the_burst(self):
+        codes = self.burst(self.customer, 11)
+
+        self.assertEqual(codes[:10], [200] * 10)
+        self.assertEqual(codes[10], 429)
+        response = self.client.get('/api/v1/orders/')
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_roles_have_separate_buckets(self):
+        self.burst(self.customer, 11)
+        self.assertEqual(self.burst(self.admin, 20), [200] * 20)
+
+    def test_payment_polling_has_its_own_bucket(self):
+        order = Order.objects.create(user=self.customer, pickup_address='A', delivery_address='B', total_amount=5)
+        self.burst(self.customer, 11)
+
+        codes = [self.client.get(f'/api/v1/orders/{order.id}/pay/').status_code for _ in range(30)]
+
+        self.assertNotIn(429, codes)
+
+    def test_token_refresh_does_not_spend_the_anonymous_bucket(self):
+        client = APIClient()
+        codes = [client.post('/api/v1/token/refresh/', {'refresh': 'bad'}).status_code for _ in range(30)]
+        self.assertNotIn(429, codes)
+        self.assertEqual(client.post('/api/v1/register/', {}).status_code, 400)
+
+    def test_bucket_refills_over_time(self):
+        store = LocalMemoryBucketStore()
+        with mock.patch('courier_app.throttling.time.monotonic', return_value=100.0):
+            self.assertEqual([store.consume('k', 2, 1.0)[0] for _ in range(3)], [True, True, False])
+        with mock.patch('courier_app.throttling.time.monotonic', return_value=101.0):
+            self.assertEqual(store.consume('k', 2, 1.0), (True, 0.0))
+
+    def test_cache_store_shares_buckets_between_instances(self):
+        caches['default'].delete('bucket')
+        self.assertTrue(CacheBucketStore().consume('bucket', 1, 0.1)[0])
+        allowed, wait = CacheBucketStore().consume('bucket', 1, 0.1)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 10, delta=0.1)
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=0, DISPATCH_COURIER_CAPACITY=2, DISPATCH_MAX_DISTANCE_KM=10)
+class DispatchTestCase(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        self.near = self.courier_at('near', 23.80, 90.40)
+        self.far = self.courier_at('far', 23.80, 90.45)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def courier_at(self, username, lat, lng):
+        courier = User.objects.create(username=username, role=User.Roles.DELIVERY_MAN)
+        CourierLocation.objects.create(courier=courier, lat=lat, lng=lng, geohash=geohash(lat, lng))
+        return courier
+
+    def order_at(self, lat, lng):
+        # "lat,lng" addresses are read as coordinates without a geocoder
+        return Order.objects.create(
+            user=self.customer, pickup_address=f'{lat},{lng}', delivery_address='B', total_amount=5
+        )
+
+    def test_orders_go_to_the_nearest_courier_with_capacity(self):
+        orders = [self.order_at(23.801, 90.401), self.order_at(23.802, 90.401), self.order_at(23.803, 90.401)]
+
+        response = self.client.post('/api/v1/orders/dispatch/')
+
+        self.assertEqual(response.json()['Data']['assigned'], 3)
+        couriers = dict(Order.objects.values_list('id', 'delivery_man_id'))
+        # The two closest fill the near courier, the third overflows to the other one
+        self.assertEqual([couriers[order.id] for order in orders], [self.near.id, self.near.id, self.far.id])
+        self.assertIsNotNone(Order.objects.get(id=orders[0].id).pickup_lat)
+
+    def test_out_of_range_and_unavailable_are_skipped(self):
+        self.order_at(24.5, 91.5)
+        CourierLocation.objects.filter(courier=self.far).update(is_available=False)
+        local = self.order_at(23.801, 90.449)
+
+        result = dispatch.dispatch_pending_orders()
+
+        self.assertEqual(result['assigned'], 1)
+        self.assertEqual(result['unassigned'], 1)
+        self.assertEqual(Order.objects.get(id=local.id).delivery_man, self.near)
+
+    def test_addresses_stay_unlocated_without_a_geocoder(self):
+        order = Order.objects.create(user=self.customer, pickup_address='House 1, Road 2', delivery_address='B', total_amount=5)
+
+        result = dispatch.dispatch_pending_orders()
+
+        self.assertEqual((result['assigned'], result['unassigned']), (0, 1))
+        self.assertIsNone(Order.objects.get(id=order.id).pickup_lat)
+        response = self.client.get(f'/api/v1/orders/{order.id}/nearby-couriers/')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(GEOCODER='courier_app.geocoding.OfflineGeocoder', GEOCODER_BOUNDS=(23.80, 90.40, 23.81, 90.41))
+    def test_configured_geocoder_locates_addresses(self):
+        order = Order.objects.create(user=self.customer, pickup_address='House 1, Road 2', delivery_address='B', total_amount=5)
+
+        result = dispatch.dispatch_pending_orders()
+
+        self.assertEqual(result['assigned'], 1)
+        self.assertEqual(Order.objects.get(id=order.id).delivery_man, self.near)
+
+    def test_stale_locations_are_not_offered_orders(self):
+        CourierLocation.objects.filter(courier=self.near).update(updated_at=timezone.now() - timedelta(hours=1))
+        order = self.order_at(23.801, 90.401)
+
+        with self.settings(DISPATCH_LOCATION_MAX_AGE=900):
+            self.assertEqual(dispatch.dispatch_pending_orders()['assigned'], 1)
+
+        self.assertEqual(Order.objects.get(id=order.id).delivery_man, self.far)
+
+    def test_python_fallback_matches_numpy(self):
+        points = [(23.80 + i / 1000, 90.40 + (i % 7) / 100) for i in range(60)]
+        couriers = [(23.80, 90.40), (23.83, 90.44), (23.85, 90.47)]
+        if dispatch.np is None:
+            self.skipTest('NumPy is not installed')
+        vectorized = dispatch.match(points, couriers, [20, 20, 20], 10)
+        with mock.patch.object(dispatch, 'np', None), mock.patch('courier_app.geo.np', None):
+            fallback = dispatch.match(points, couriers, [20, 20, 20], 10)
+
+        self.assertEqual(
+            {order: courier for order, (courier, _) in vectorized.items()},
+            {order: courier for order, (courier, _) in fallback.items()},
+        )
+
+    def test_nearby_couriers_uses_neighbouring_cells(self):
+        order = self.order_at(23.801, 90.401)
+        self.courier_at('elsewhere', 25.0, 89.0)
+
+        response = self.client.get(f'/api/v1/orders/{order.id}/nearby-couriers/')
+
+        nearby = [courier['delivery_man_id'] for courier in response.json()['Data']]
+        self.assertEqual(nearby, [self.near.id, self.far.id])
+        self.assertIn(geohash(23.80, 90.45), neighbours(geohash(23.801, 90.401)))
+
+    def test_courier_reports_location(self):
+        self.client.force_authenticate(self.near)
+        response = self.client.put('/api/v1/couriers/location/', {'lat': 23.7, 'lng': 90.3, 'is_available': False})
+
+        self.assertEqual(response.status_code, 200)
+        location = CourierLocation.objects.get(courier=self.near)
+        self.assertEqual((location.geohash, location.is_available), (geohash(23.7, 90.3), False))
+
+    def test_geohash_and_distance(self):
+        self.assertEqual(geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertAlmostEqual(haversine_km(23.8103, 90.4125, 22.3569, 91.7832), 213.0, delta=2)
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=0)
+class RoutePlanningTestCase(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        CourierLocation.objects.create(courier=self.courier, lat=23.80, lng=90.40, geohash=geohash(23.80, 90.40))
+        self.client = APIClient()
+        self.client.force_authenticate(self.courier)
+
+    def order(self, pickup, delivery, status=Order.StatusChoices.PENDING):
+        return Order.objects.create(
+            user=self.customer, delivery_man=self.courier, status=status, total_amount=5,
+            pickup_address='{},{}'.format(*pickup), delivery_address='{},{}'.format(*delivery),
+        )
+
+    def test_route_visits_pickups_before_deliveries(self):
+        first = self.order((23.81, 90.40), (23.83, 90.40))
+        second = self.order((23.82, 90.40), (23.84, 90.40))
+        picked = self.order((23.70, 90.30), (23.805, 90.40), status=Order.StatusChoices.PICKED)
+
+        route = self.client.get('/api/v1/orders/assigned/route/').json()['Data']
+
+        stops = [(stop['order_id'], stop['type']) for stop in route['stops']]
+        self.assertEqual(stops, [
+            (picked.id, 'delivery'), (first.id, 'pickup'), (second.id, 'pickup'),
+            (first.id, 'delivery'), (second.id, 'delivery'),
+        ])
+        self.assertAlmostEqual(route['distance_km'], 4.45, delta=0.05)
+
+    def test_route_is_cached_until_assignments_change(self):
+        order = self.order((23.81, 90.40), (23.83, 90.40))
+        self.assertFalse(self.client.get('/api/v1/orders/assigned/route/').json()['Data']['cached'])
+        self.assertTrue(self.client.get('/api/v1/orders/assigned/route/').json()['Data']['cached'])
+
+        order.transition_to(Order.StatusChoices.PICKED)
+        route = self.client.get('/api/v1/orders/assigned/route/').json()['Data']
+
+        self.assertFalse(route['cached'])
+        self.assertEqual([stop['type'] for stop in route['stops']], ['delivery'])
+
+    def test_route_is_planned_again_when_the_courier_moves_away(self):
+        self.order((23.81, 90.40), (23.83, 90.40))
+        route = lambda: self.client.get('/api/v1/orders/assigned/route/').json()['Data']
+        self.assertFalse(route()['cached'])
+
+        # A few metres within the same cell keep the plan
+        CourierLocation.objects.filter(courier=self.courier).update(lat=23.8001, lng=90.4001)
+        self.assertTrue(route()['cached'])
+
+        CourierLocation.objects.filter(courier=self.courier).update(lat=23.84, lng=90.40)
+        self.assertFalse(route()['cached'])
+
+    @override_settings(ORDER_RESPONSE_CACHE_TTL=300)
+    def test_geocoding_a_route_counts_as_a_write(self):
+        caches['order_responses'].clear()
+        order = self.order((23.81, 90.40), (23.83, 90.40))
+        self.client.force_authenticate(self.customer)
+        before = self.client.get('/api/v1/orders/status/').json()['results'][0]
+        etag = self.client.get(f'/api/v1/orders/{order.id}/')['ETag']
+
+        self.client.force_authenticate(self.courier)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get('/api/v1/orders/assigned/route/')
+
+        order.refresh_from_db()
+        self.assertGreater(order.updated_at, order.created_at)
+        self.client.force_authenticate(self.customer)
+        after = self.client.get('/api/v1/orders/status/').json()['results'][0]
+        self.assertNotEqual(after, before)
+        self.assertEqual(self.client.get(f'/api/v1/orders/{order.id}/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_route_requires_delivery_man(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/v1/orders/assigned/route/').status_code, 403)
+
+    def test_two_opt_respects_precedence_with_and_without_numpy(self):
+        rng = random.Random(7)
+        stops = [(23.7 + rng.random() / 5, 90.3 + rng.random() / 5) for _ in range(80)]
+        # Even stops are pickups, each followed by its delivery
+        pickup_of = {delivery: delivery - 1 for delivery in range(1, 80, 2)}
+
+        with override_settings(ROUTE_TIME_BUDGET=0):
+            _, greedy_km = routing.plan_route((23.8, 90.4), stops, pickup_of)
+        plans = [routing.plan_route((23.8, 90.4), stops, pickup_of)]
+        with mock.patch.object(routing, 'np', None), mock.patch('courier_app.geo.np', None):
+            plans.append(routing.plan_route((23.8, 90.4), stops, pickup_of))
+
+        for sequence, km in plans:
+            position = {stop: index for index, stop in enumerate(sequence)}
+            self.assertEqual(sorted(sequence), list(range(len(stops))))
+            self.assertTrue(all(position[pickup] < position[delivery] for delivery, pickup in pickup_of.items()))
+            self.assertLessEqual(km, greedy_km)
+        self.assertAlmostEqual(plans[0][1], plans[1][1], places=6)
+
+
+class OrderAnalyticsTestCase(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_order(self, **fields):
+        return Order.objects.create(
+            user=self.customer, pickup_address='A', delivery_address='B', total_amount=10, **fields
+        )
+
+    def stat_totals(self):
+        rows = OrderStat.objects.values('day', 'status', 'courier_id').annotate(
+            orders=Sum('orders'), paid_orders=Sum('paid_orders'), revenue=Sum('revenue'), paid_revenue=Sum('paid_revenue')
+        )
+        return {
+            (row['day'], row['status'], row['courier_id']): (row['orders'], row['paid_orders'], row['revenue'], row['paid_revenue'])
+            for row in rows
+            if row['orders']
+        }
+
+    def test_incremental_totals_match_a_rebuild(self):
+        first = self.create_order()
+        second = self.create_order(stripe_payment_intent='pi_1')
+        third = self.create_order(created_at=timezone.now() - timedelta(days=3))
+        self.create_order().delete()
+        bulk_assign([first.id, second.id, third.id], self.courier, self.admin)
+        Order.objects.get(id=first.id).transition_to(Order.StatusChoices.PICKED)
+        bulk_transition([second.id, third.id], Order.StatusChoices.PICKED, self.admin)
+        StripeEvent.objects.create(id='evt_1', type=PAYMENT_SUCCEEDED, payment_intent='pi_1')
+        process_stripe_events()
+        third = Order.objects.get(id=third.id)
+        third.total_amount = 25
+        third.save()
+        CourierLocation.objects.create(courier=self.courier, lat=23.8, lng=90.4, geohash=geohash(23.8, 90.4))
+        Order.objects.create(user=self.customer, pickup_address='23.801,90.401', delivery_address='B', total_amount=4)
+        self.assertEqual(dispatch.dispatch_pending_orders()['assigned'], 1)
+
+        incremental = self.stat_totals()
+        analytics.rebuild()
+
+        self.assertEqual(incremental, self.stat_totals())
+        today = timezone.localdate()
+        self.assertEqual(incremental[today, Order.StatusChoices.PICKED, self.courier.id][:2], (2, 1))
+
+    def test_dispatch_records_orders_changed_after_its_read(self):
+        CourierLocation.objects.create(courier=self.courier, lat=23.8, lng=90.4, geohash=geohash(23.8, 90.4))
+        paid, picked = (
+            Order.objects.create(user=self.customer, pickup_address='23.801,90.401', delivery_address='B', total_amount=10)
+            for _ in range(2)
+        )
+        real_match = dispatch.match
+
+        def match_then_change(*args):
+            # Another request writes both orders between the run's read and its UPDATE
+            order = Order.objects.get(id=paid.id)
+            order.is_paid = True
+            order.save()
+            Order.objects.get(id=picked.id).transition_to(Order.StatusChoices.PICKED)
+            return real_match(*args)
+
+        with mock.patch.object(dispatch, 'match', match_then_change):
+            self.assertEqual(dispatch.dispatch_pending_orders()['assigned'], 1)
+
+        self.assertIsNone(Order.objects.get(id=picked.id).delivery_man_id)
+        incremental = self.stat_totals()
+        analytics.rebuild()
+        self.assertEqual(incremental, self.stat_totals())
+
+    def test_deleting_users_keeps_totals_matching_a_rebuild(self):
+        carried = self.create_order(delivery_man=self.courier)
+        carried.transition_to(Order.StatusChoices.PICKED)
+        for status in ('IN_TRANSIT', 'DELIVERED', 'COMPLETE'):
+            Order.objects.get(id=carried.id).transition_to(status)
+        Order.objects.filter(id=carried.id).update(updated_at=timezone.now() - timedelta(days=60))
+        archive_orders()
+        self.create_order(delivery_man=self.courier)
+        leaving = User.objects.create(username='leaving', role=User.Roles.USER)
+        Order.objects.create(user=leaving, pickup_address='A', delivery_address='B', total_amount=3)
+
+        self.courier.delete()
+        User.objects.get(id=leaving.id).delete()
+
+        incremental = self.stat_totals()
+        analytics.rebuild()
+        self.assertEqual(incremental, self.stat_totals())
+        self.assertFalse(any(courier_id for _, _, courier_id in incremental))
+
+    def test_compaction_folds_deltas_into_one_row_per_bucket(self):
+        order = self.create_order(delivery_man=self.courier)
+        order.transition_to(Order.StatusChoices.PICKED)
+        order.transition_to(Order.StatusChoices.IN_TRANSIT)
+        before = self.stat_totals()
+
+        call_command('compact_order_stats', stdout=mock.Mock())
+
+        self.assertEqual(self.stat_totals(), before)
+        self.assertEqual(OrderStat.objects.count(), 1)
+
+    def test_dashboard_reads_rollups_only(self):
+        for index in range(5):
+            self.create_order(delivery_man=self.courier, status=Order.StatusChoices.DELIVERED, is_paid=index % 2 == 0)
+        self.create_order()
+
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/v1/analytics/orders/').json()['Data']
+
+        self.assertFalse(any('courier_app_order"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(data['totals']['orders'], 6)
+        self.assertEqual(data['totals']['paid_orders'], 3)
+        self.assertEqual(data['totals']['revenue'], '60.00')
+        self.assertEqual(data['totals']['paid_revenue'], '30.00')
+        self.assertEqual(data['days'][0]['by_status'], {'DELIVERED': 5, 'PENDING': 1})
+        self.assertEqual(data['couriers'], [
+            {'delivery_man_id': self.courier.id, 'orders': 5, 'delivered': 5, 'by_status': {'DELIVERED': 5}}
+        ])
+
+    def test_dashboard_is_admin_only_and_validates_dates(self):
+        self.assertEqual(self.client.get('/api/v1/analytics/orders/?start=2026-02-30').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/analytics/orders/?start=2026-05-01&end=2026-04-01').status_code, 400)
+        self.client.force_authenticate(self.courier)
+        self.assertEqual(self.client.get('/api/v1/analytics/orders/').status_code, 403)
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=0)
+class OrderArchiveTestCase(TestCase):
+    PATHS = {
+        Order.StatusChoices.COMPLETE: ['PICKED', 'IN_TRANSIT', 'DELIVERED', 'COMPLETE'],
+        Order.StatusChoices.RETURNED: ['PICKED', 'IN_TRANSIT', 'RETURNED'],
+    }
+
+    def setUp(self):
+        self.customer = User.objects.create(username='customer', role=User.Roles.USER)
+        self.other = User.objects.create(username='other', role=User.Roles.USER)
+        self.courier = User.objects.create(username='courier', role=User.Roles.DELIVERY_MAN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def finished_order(self, final_status=Order.StatusChoices.COMPLETE, days_ago=60):
+        order = Order.objects.create(
+            user=self.customer, delivery_man=self.courier, pickup_address='A', delivery_address='B', total_amount=7
+        )
+        for status in self.PATHS[final_status]:
+            order.transition_to(status, by=self.courier)
+        Order.objects.filter(id=order.id).update(updated_at=timezone.now() - timedelta(days=days_ago))
+        return order
+
+    def test_only_old_finished_orders_move(self):
+        complete, returned = self.finished_order(), self.finished_order(Order.StatusChoices.RETURNED)
+        recent = self.finished_order(days_ago=1)
+        open_order = Order.objects.create(user=self.customer, pickup_address='A', delivery_address='B', total_amount=7)
+        Order.objects.filter(id=open_order.id).update(updated_at=timezone.now() - timedelta(days=60))
+
+        self.assertEqual(archive_orders(batch_size=1), 2)
+
+        self.assertEqual(set(Order.objects.values_list('id', flat=True)), {recent.id, open_order.id})
+        self.assertEqual(set(ArchivedOrder.objects.values_list('id', flat=True)), {complete.id, returned.id})
+        self.assertFalse(OrderStatusEvent.objects.filter(order_id=complete.id).exists())
+        history = ArchivedOrder.objects.get(id=returned.id).status_history
+        self.assertEqual([event['to_status'] for event in history], ['PICKED', 'IN_TRANSIT', 'RETURNED'])
+        self.assertEqual(history[0]['changed_by'], str(self.courier))
+
+    def test_payment_jobs_are_kept_in_the_archive(self):
+        order = self.finished_order()
+        job = PaymentJob.objects.create(
+            order=order, status=PaymentJob.StatusChoices.FAILED, attempts=3, last_error='card_declined'
+        )
+
+        archive_orders()
+
+        self.assertFalse(PaymentJob.objects.exists())
+        [kept] = ArchivedOrder.objects.get(id=order.id).payment_jobs
+        self.assertEqual(
+            (kept['id'], kept['status'], kept['attempts'], kept['last_error']),
+            (job.id, 'FAILED', 3, 'card_declined'),
+        )
+
+    def test_export_includes_archived_orders_on_request(self):
+        archived = self.finished_order()
+        live = Order.objects.create(user=self.customer, pickup_address='A', delivery_address='B', total_amount=7)
+        archive_orders()
+
+        def exported(query):
+            response = self.client.get(f'/api/v1/orders/export/?file_format=jsonl{query}')
+            return [json.loads(line)['id'] for line in b''.join(response.streaming_content).decode().splitlines()]
+
+        self.assertEqual(exported(''), [live.id])
+        self.assertEqual(exported('&include_archived=1'), [archived.id, live.id])
+        self.assertEqual(exported(f'&include_archived=1&after={archived.id}'), [live.id])
+
+    def test_archived_orders_keep_counting_in_analytics(self):
+        self.finished_order()
+        before = analytics.order_summary(*analytics.default_range())['totals']
+
+        archive_orders()
+        analytics.rebuild()
+
+        self.assertEqual(analytics.order_summary(*analytics.default_range())['totals'], before)
+
+    def test_retrieve_and_history_fall_back_to_the_archive(self):
+        order = self.finished_order()
+        live = self.client.get(f'/api/v1/orders/{order.id}/').json()
+        archive_orders()
+
+        archived = self.client.get(f'/api/v1/orders/{order.id}/').json()
+        history = self.client.get(f'/api/v1/orders/{order.id}/history/').json()['Data']
+
+        self.assertEqual({key: archived[key] for key in live}, live)
+        self.assertIn('archived_at', archived)
+        self.assertEqual([event['to_status'] for event in history], ['PICKED', 'IN_TRANSIT', 'DELIVERED', 'COMPLETE'])
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(f'/api/v1/orders/{order.id}/').status_code, 404)
+
+
+@override_settings(ORDER_RESPONSE_CACHE_TTL=0, METRICS_TOKEN='scrape-me')
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.admin = User.objects.create(username='admin', role=User.Roles.ADMIN)
+        Order.objects.create(user=self.admin, pickup_address='A', delivery_address='B', total_amount=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def scrape(self, token='scrape-me'):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def series(self, histogram, *labels):
+        return histogram.series[labels]
+
+    def test_requests_record_latency_queries_and_serializer_time(self):
+        self.client.get('/api/v1/orders/')
+        self.client.get('/api/v1/orders/')
+
+        counts, _ = self.series(registry.request_seconds, 'orders-list', 'GET')
+        self.assertEqual(sum(counts), 2)
+        _, queries = self.series(registry.request_queries, 'orders-list', 'GET')
+        # Two queries per list request, see OrderViewSet.query_budget
+        self.assertEqual(queries, 4)
+        self.assertGreater(self.series(registry.request_serializer_seconds, 'orders-list', 'GET')[1], 0)
+
+    def test_scrape_renders_prometheus_text(self):
+        self.client.get('/api/v1/orders/')
+
+        response = self.scrape()
+        body = response.content.decode()
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('# TYPE courier_http_request_duration_seconds histogram', body)
+        self.assertIn('courier_http_request_duration_seconds_count{view="orders-list",method="GET"} 1', body)
+        self.assertIn('courier_http_request_db_queries_bucket{view="orders-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('courier_http_responses_total{view="orders-list",method="GET",status="200"} 1', body)
+        self.assertIn('courier_cache_hits_total{cache="payment_intents"}', body)
+
+    def test_scrape_requires_the_token(self):
+        self.assertEqual(self.scrape('wrong').status_code, 401)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.scrape().status_code, 404)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_metrics_record_nothing(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+
+        self.assertEqual(client.get('/api/v1/orders/').status_code, 200)
+
+        self.assertEqual(registry.request_seconds.series, {})
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 404)
+
+    def test_stripe_calls_are_timed_per_endpoint(self):
+        inner = mock.Mock()
+        inner.request_with_retries.return_value = ('{}', 200, {})
+        client = TimedStripeClient(inner)
+
+        client.request_with_retries('post', 'https://api.stripe.com/v1/payment_intents/pi_1/confirm', {}, None)
+
+        counts, _ = self.series(registry.stripe_seconds, '/v1/payment_intents', 'POST')
+        self.assertEqual(sum(counts), 1)
+        self.assertIs(client.close, inner.close)
@@ -0,0 +1,156 @@
+"""
+Per-role request throttling with token buckets.
+
+Each client gets a bucket holding up to N tokens for a rate of "N/period",
+refilled continuously at N/period tokens per second; a request spends one
+token. Rates come from DEFAULT_THROTTLE_RATES under the scope of the caller's
+role, so admins, delivery men and customers are limited independently. A
+view may set ``throttle_scope`` to give its requests a bucket of their own.
+
+Bucket state lives in a store (THROTTLE_BUCKET_STORE). CacheBucketStore keeps
+it in a shared cache and updates it atomically with a Lua script on Redis;
+LocalMemoryBucketStore keeps it in a process-local dict.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .models import User
+
+ROLE_SCOPES = {
+    User.Roles.ADMIN: 'admin',
+    User.Roles.DELIVERY_MAN: 'delivery_man',
+    User.Roles.USER: 'user',
+}
+
+# KEYS[1]: bucket; ARGV: capacity, refill rate (tokens/s), now (s)
+CONSUME_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+def refill(tokens, updated_at, capacity, rate, now):
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def wait_for_token(tokens, rate):
+    return (1 - tokens) / rate
+
+
+class CacheBucketStore:
+    """Buckets in a Django cache, shared by every process using it."""
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def consume(self, key, capacity, rate):
+        """Spend one token. Returns (allowed, seconds until the next token)."""
+        now = time.time()
+        if isinstance(self.cache, RedisCache):
+            return self._consume_redis(key, capacity, rate, now)
+
+        # Without Redis the read-modify-write is not atomic; concurrent
+        # requests of one client may each spend the same token
+        tokens, updated_at = self.cache.get(key, (capacity, now))
+        tokens = refill(tokens, updated_at, capacity, rate, now)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.cache.set(key, (tokens, now), timeout=math.ceil(capacity / rate) + 1)
+        return allowed, 0.0 if allowed else wait_for_token(tokens, rate)
+
+    def _consume_redis(self, key, capacity, rate, now):
+        key = self.cache.make_and_validate_key(key)
+        client = self.cache._cache.get_client(key, write=True)
+        allowed, tokens = client.eval(CONSUME_SCRIPT, 1, key, capacity, rate, now)
+        return bool(allowed), 0.0 if allowed else wait_for_token(float(tokens), rate)
+
+
+class LocalMemoryBucketStore:
+    """
+    Buckets in a process-local dict, for tests and single-process servers.
+
+    Lock-free: each bucket is an immutable tuple replaced in one assignment,
+    so a race can at worst let a concurrent request reuse a token.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    def consume(self, key, capacity, rate):
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.get(key, (capacity, now))
+        tokens = refill(tokens, updated_at, capacity, rate, now)
+        allowed = tokens >= 1
+        self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+        return allowed, 0.0 if allowed else wait_for_token(tokens, rate)
+
+    def clear(self):
+        self.buckets = {}
+
+
+_stores = {}
+
+
+def get_bucket_store():
+    path = settings.THROTTLE_BUCKET_STORE
+    if path not in _stores:
+        _stores[path] = import_string(path)()
+    return _stores[path]
+
+
+class RoleRateThrottle(SimpleRateThrottle):
+    """
+    Token-bucket throttle scoped by the view's ``throttle_scope`` if it has
+    one, otherwise by role: admin, delivery_man, user or anon.
+    """
+
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def __init__(self):
+        # Scope and rate depend on the request, see allow_request()
+        self._wait = 0.0
+
+    def get_cache_key(self, request, view):
+        ident = request.user.pk if request.user.is_authenticated else self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        user = request.user
+        self.scope = getattr(view, 'throttle_scope', None) or (
+            ROLE_SCOPES.get(user.role, 'user') if user.is_authenticated else 'anon'
+        )
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        allowed, self._wait = get_bucket_store().consume(
+            self.get_cache_key(request, view), self.num_requests, self.num_requests / self.duration
+        )
+        return allowed
+
+    def get_rate(self):
+        # Read per request rather than once at import, so overridden settings
+        # apply; scopes without a rate are not throttled
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def wait(self):
+        return self._wait
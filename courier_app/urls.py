@@ -7,9 +7,15 @@ from .views import (
     OrderViewSet,
     UserOrderStatusView,
     CustomTokenObtainPairView,
+    AuthTokenRefreshView,
+    AuthTokenBlacklistView,
     UserViewSet,
+    StripeWebhookView,
+    CourierLocationView,
+    OrderAnalyticsView,
+    OrderEventTokenView,
+    order_events,
 )
-from rest_framework_simplejwt.views import TokenRefreshView
 
 order_router = DefaultRouter()
 order_router.register(r'', OrderViewSet, basename='orders')
@@ -20,11 +26,17 @@ user_router.register(r'', UserViewSet, basename='users')
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/refresh/', AuthTokenRefreshView.as_view(), name='token_refresh'),
+    path('logout/', AuthTokenBlacklistView.as_view(), name='token_blacklist'),
     path('profile/', ProfileView.as_view(), name='profile'),
     path('orders/status/', UserOrderStatusView.as_view(), name='user_order_status'),
+    path('orders/events/', order_events, name='order_events'),
+    path('orders/events/token/', OrderEventTokenView.as_view(), name='order_events_token'),
     path('orders/', include(order_router.urls)),
     path('orders/<int:order_id>/pay/', PayOrderView.as_view(), name='pay_order'),
+    path('analytics/orders/', OrderAnalyticsView.as_view(), name='order_analytics'),
+    path('couriers/location/', CourierLocationView.as_view(), name='courier_location'),
+    path('payments/stripe/webhook/', StripeWebhookView.as_view(), name='stripe_webhook'),
 
     path('users/', include(user_router.urls)),
     path('users/<int:user_id>/orders/', UserOrderStatusView.as_view(), name='user_orders'),
@@ -28,7 +28,10 @@ def custom_exception_handler(exc, context):
             'statusCode': response.status_code,
             'message': str(exc),
             'Data': {}
-        }, status=response.status_code)
+        }, status=response.status_code, headers={
+            # Keep what clients need to retry or authenticate
+            name: response[name] for name in ('Retry-After', 'WWW-Authenticate') if response.has_header(name)
+        })
 
     return Response({
         'success': False,
@@ -1,40 +1,98 @@
-from django.forms import ValidationError
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
 from .utils import success_response
 from .serializers import CustomTokenObtainPairSerializer
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.views import TokenBlacklistView, TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from .utils import error_response, success_response
-import stripe
+import asyncio
+from datetime import date
+from asgiref.sync import sync_to_async
 import logging
+from functools import partial
+import stripe
 
-from .models import User, Order
-from .serializers import RegisterSerializer, UserSerializer, OrderSerializer
+from .analytics import MAX_DAYS, default_range, order_summary
+from .authentication import StatelessJWTAuthentication, StreamToken
+from .conditional import collection_validators, conditional, object_validators
+from .dispatch import couriers_near, dispatch_pending_orders
+from .geo import geohash
+from .geocoding import geocode_many
+from .idempotency import idempotent
+from .login_throttle import LoginThrottle
+from .models import User, Order, OrderStatusEvent, PaymentJob, CourierLocation, ArchivedOrder, InvalidStatusTransition
+from .order_bulk import bulk_assign, bulk_transition
+from .order_export import CONTENT_TYPES, export_rows, stream_export
+from .order_import import FORMATS, detect_format, import_orders, iter_rows
+from .pagination import OrderCursorPagination
+from .realtime import broker_problem, get_broker, user_channel
+from .response_cache import cached_response
+from .routing import courier_route
+from .payments import enqueue_payment_intent, latest_payment_job, process_stripe_events, record_stripe_event
+from .serializers import (
+    RegisterSerializer,
+    UserSerializer,
+    OrderSerializer,
+    ArchivedOrderSerializer,
+    OrderStatusEventSerializer,
+    PaymentJobSerializer,
+    BulkAssignSerializer,
+    BulkStatusSerializer,
+    CourierLocationSerializer,
+)
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
 logger = logging.getLogger(__name__)
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
+    throttle_scope = 'auth'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
+        throttle = LoginThrottle(request, request.data.get(serializer.username_field))
+
+        # Refuse before the password is hashed
+        retry_after = throttle.retry_after()
+        if retry_after is not None:
+            response = error_response(message="Too many failed login attempts", status_code=429)
+            response['Retry-After'] = str(retry_after)
+            return response
 
         try:
             serializer.is_valid(raise_exception=True)
-            return success_response(serializer.validated_data, "Login successful", 200)
-        except Exception as e:
+        except AuthenticationFailed:
+            throttle.record_failure()
             return Response({
                 "success": False,
                 "statusCode": 401,
                 "message": "Invalid credentials",
                 "Data": {}
             }, status=401)
+        except ValidationError as e:
+            return error_response(e.detail, "Username and password are required", 400)
+
+        throttle.reset_username()
+        return success_response(serializer.validated_data, "Login successful", 200)
+
+
+# Token refresh and logout share the login's per-IP bucket, not the anon one
+class AuthTokenRefreshView(TokenRefreshView):
+    throttle_scope = 'auth'
+
+
+class AuthTokenBlacklistView(TokenBlacklistView):
+    throttle_scope = 'auth'
 
 
 # Register endpoint
@@ -54,6 +112,9 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
+        if self.request.user.get_deferred_fields():
+            # Built from token claims; load the whole profile in one query
+            return User.objects.get(pk=self.request.user.pk)
         return self.request.user
     
     def retrieve(self, request, *args, **kwargs):
@@ -114,12 +175,21 @@ class IsOrderOwner(permissions.BasePermission):
 
 class UserOrderStatusView(APIView):
     permission_classes = [IsAuthenticated]
+    # Max queries per request once the user is authenticated (see tests.py):
+    # the conditional GET aggregate plus the page itself
+    query_budget = {'get': 2}
 
+    @cached_response
     def get(self, request):
         user = request.user
-        orders = Order.objects.filter(user=user)
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        orders = Order.objects.with_related().filter(user=user)
+        return conditional(request, collection_validators(request, orders), partial(self.paginated_response, request, orders))
+
+    def paginated_response(self, request, orders):
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        serializer = OrderSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class OrderViewSet(viewsets.ModelViewSet):
@@ -131,15 +201,33 @@ class OrderViewSet(viewsets.ModelViewSet):
     """
     serializer_class = OrderSerializer
     queryset = Order.objects.all()
+    pagination_class = OrderCursorPagination
+    # Max queries per action once the user is authenticated (see tests.py);
+    # list pays one extra aggregate query for its conditional GET validators
+    query_budget = {'list': 2, 'retrieve': 1, 'assigned': 1, 'history': 2}
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == User.Roles.ADMIN:
-            return Order.objects.all()
-        elif user.role == User.Roles.DELIVERY_MAN:
-            return Order.objects.filter(delivery_man=user)
-        else:  # regular user
-            return Order.objects.filter(user=user)
+        return Order.objects.with_related().visible_to(self.request.user)
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return conditional(request, collection_validators(request, queryset), partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            order = self.get_object()
+        except Http404:
+            # Finished orders move to the archive after a while
+            order = self.get_archived_object()
+            serializer = ArchivedOrderSerializer
+        else:
+            serializer = self.get_serializer
+        return conditional(request, object_validators(request, order), lambda: Response(serializer(order).data))
+
+    def get_archived_object(self):
+        queryset = ArchivedOrder.objects.with_related().visible_to(self.request.user)
+        return get_object_or_404(queryset, pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field])
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -153,60 +241,48 @@ class OrderViewSet(viewsets.ModelViewSet):
                 return [permissions.IsAdminUser()]  # effectively deny access
         elif self.action == 'create':
             return [permissions.IsAuthenticated()]
-        elif self.action == 'assigned':
+        elif self.action in ['assigned', 'route']:
             # Only delivery men can access assigned orders explicitly
             return [permissions.IsAuthenticated(), IsDeliveryMan()]
+        elif self.action in ['bulk_assign', 'auto_dispatch', 'nearby_couriers']:
+            return [permissions.IsAuthenticated(), IsAdmin()]
+        elif self.action == 'bulk_status':
+            # Delivery men only reach their assigned orders (Order.objects.visible_to)
+            return [permissions.IsAuthenticated(), (IsAdmin | IsDeliveryMan)()]
         else:
             # list, retrieve allowed for authenticated users
             return [permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
-        # Save order with user set
-        order = serializer.save(user=self.request.user)
-
-        # Validate total_amount presence and positive value
-        if order.total_amount is None:
+        # Validate total_amount presence and positive value before anything is written
+        total_amount = serializer.validated_data.get('total_amount')
+        if total_amount is None:
             raise ValidationError({"total_amount": "Total amount is required."})
 
-        if order.total_amount <= 0:
+        if total_amount <= 0:
             raise ValidationError({"total_amount": "Total amount must be greater than 0."})
 
-        # Optional payment on creation
+        # Optional payment on creation: the order and its payment job are
+        # inserted together, Stripe is only called once they are committed.
+        # The client polls /orders/<id>/pay/ for the client_secret.
         pay_now = self.request.data.get('pay_now', False)
-        if pay_now in [True, 'true', 'True', '1', 1]:
-            try:
-                intent = stripe.PaymentIntent.create(
-                    amount=int(order.total_amount * 100),  # dollars to cents
-                    currency='usd',
-                    metadata={'order_id': order.id},
-                    automatic_payment_methods={'enabled': True},
-                )
-                order.stripe_payment_intent = intent.id
-                order.payment_method = 'stripe'
-                order.save()
-
-                # Attach client_secret for frontend payment
-                self.extra_context = {'client_secret': intent.client_secret}
+        with transaction.atomic():
+            order = serializer.save(user=self.request.user)
+            if pay_now in [True, 'true', 'True', '1', 1]:
+                self.payment_job = enqueue_payment_intent(order, new_order=True)
 
-            except stripe.error.StripeError as e:
-                logger.error(f"Stripe error on order creation payment intent: {e}")
-
-        # No explicit return needed — DRF handles response
-
-        def create(self, request, *args, **kwargs):
-            try:
-                response = super().create(request, *args, **kwargs)
-                data = dict(response.data) if hasattr(response, 'data') else {}
-
-                if hasattr(self, 'extra_context') and 'client_secret' in self.extra_context:
-                    data['client_secret'] = self.extra_context['client_secret']
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        data = dict(response.data)
 
-                return success_response(data, "Order created successfully", 201)
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                return Response({"error": str(e)}, status=500)
+        payment_job = getattr(self, 'payment_job', None)
+        if payment_job is not None:
+            data['payment'] = PaymentJobSerializer(payment_job).data
+            if payment_job.client_secret:
+                data['client_secret'] = payment_job.client_secret
 
+        return success_response(data, "Order created successfully", 201)
 
     def update(self, request, *args, **kwargs):
         order = self.get_object()
@@ -220,8 +296,10 @@ class OrderViewSet(viewsets.ModelViewSet):
             if status_field not in dict(Order.StatusChoices.choices):
                 return error_response(message="Invalid status.", status_code=status.HTTP_400_BAD_REQUEST)
 
-            order.status = status_field
-            order.save()
+            try:
+                order.transition_to(status_field, by=request.user)
+            except InvalidStatusTransition as e:
+                return error_response(message=str(e), status_code=status.HTTP_400_BAD_REQUEST)
             serializer = self.get_serializer(order)
             return success_response(data=serializer.data, message="Order updated successfully", status_code=status.HTTP_200_OK)
 
@@ -232,7 +310,125 @@ class OrderViewSet(viewsets.ModelViewSet):
         else:
             return error_response(message="You do not have permission to update this order.", status_code=status.HTTP_403_FORBIDDEN)
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_orders(self, request):
+        """
+        Bulk-create the caller's orders from a CSV or JSON Lines file.
+        URL: /api/v1/orders/import/
+
+        Send a multipart upload in ``file`` or the raw file as the request body
+        (text/csv or application/x-ndjson). Pass ``?file_format=csv|jsonl`` to
+        override detection.
+        """
+        upload = request.FILES.get('file') if request.content_type.startswith('multipart/') else None
+        fmt = request.query_params.get('file_format') or detect_format(
+            upload.name if upload else '', request.content_type
+        )
+        if fmt not in FORMATS:
+            return error_response(message=f"Unsupported format, use one of: {', '.join(FORMATS)}.", status_code=status.HTTP_400_BAD_REQUEST)
+
+        result = import_orders(iter_rows(upload or request.stream, fmt), request.user)
+        message = "Orders imported successfully" if not result['failed'] else "Orders imported with errors"
+        return success_response(data=result, message=message, status_code=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Stream the orders visible to the caller as CSV or JSON Lines.
+        URL: /api/v1/orders/export/?file_format=csv|jsonl&after=<id>&include_archived=1
+
+        Rows come in id order; resume a broken download by passing the id of
+        the last row received as ``after``. Archived orders are left out
+        unless ``include_archived=1``.
+        """
+        fmt = request.query_params.get('file_format', 'csv')
+        if fmt not in FORMATS:
+            return error_response(message=f"Unsupported format, use one of: {', '.join(FORMATS)}.", status_code=status.HTTP_400_BAD_REQUEST)
+        after = request.query_params.get('after')
+        if after is not None and not after.isdigit():
+            return error_response(message="after must be an order id.", status_code=status.HTTP_400_BAD_REQUEST)
+
+        archived = None
+        if request.query_params.get('include_archived') in ('1', 'true'):
+            archived = ArchivedOrder.objects.visible_to(request.user)
+        rows = export_rows(
+            Order.objects.visible_to(request.user), after=int(after) if after else None, archived=archived
+        )
+        response = StreamingHttpResponse(stream_export(rows, fmt), content_type=CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="orders.{fmt}"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='bulk-assign')
+    def bulk_assign(self, request):
+        """
+        Assign many orders to one delivery man in a single UPDATE.
+        URL: /api/v1/orders/bulk-assign/
+        """
+        serializer = BulkAssignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = bulk_assign(
+            serializer.validated_data['order_ids'], serializer.validated_data['delivery_man'], request.user
+        )
+        return success_response(data=result, message="Orders assigned successfully", status_code=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='bulk-status')
+    def bulk_status(self, request):
+        """
+        Move many orders to one status in a single UPDATE.
+        URL: /api/v1/orders/bulk-status/
+        """
+        serializer = BulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = bulk_transition(
+            serializer.validated_data['order_ids'], serializer.validated_data['status'], request.user
+        )
+        return success_response(data=result, message="Order statuses updated successfully", status_code=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='dispatch')
+    def auto_dispatch(self, request):
+        """
+        Assign pending orders to the nearest available delivery men.
+        URL: /api/v1/orders/dispatch/
+        """
+        limit = request.data.get('limit')
+        try:
+            limit = int(limit) if limit is not None else None
+        except (TypeError, ValueError):
+            return error_response({"limit": "Must be an integer."}, "Invalid limit", status.HTTP_400_BAD_REQUEST)
+        result = dispatch_pending_orders(limit=limit)
+        return success_response(data=result, message="Orders dispatched successfully", status_code=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='nearby-couriers')
+    def nearby_couriers(self, request, pk=None):
+        """
+        Available delivery men around the order's pickup, nearest first.
+        URL: /api/v1/orders/<id>/nearby-couriers/
+        """
+        order = self.get_object()
+        point = (order.pickup_lat, order.pickup_lng)
+        if order.pickup_lat is None:
+            point = geocode_many([order.pickup_address])[order.pickup_address]
+            if point is None:
+                return error_response(message="Pickup address could not be located.", status_code=status.HTTP_400_BAD_REQUEST)
+        return success_response(data=couriers_near(*point), message="Nearby couriers retrieved successfully")
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Status changes of one order, oldest first.
+        URL: /api/v1/orders/<id>/history/
+        """
+        try:
+            order = self.get_object()
+        except Http404:
+            history = self.get_archived_object().status_history
+        else:
+            events = OrderStatusEvent.objects.filter(order=order).select_related('changed_by').order_by('created_at', 'id')
+            history = OrderStatusEventSerializer(events, many=True).data
+        return success_response(data=history, message="Order history retrieved successfully", status_code=status.HTTP_200_OK)
+
     @action(detail=False, methods=['get'])
+    @cached_response
     def assigned(self, request):
         """
         Custom endpoint for delivery men to view their assigned orders.
@@ -241,48 +437,211 @@ class OrderViewSet(viewsets.ModelViewSet):
         if request.user.role != User.Roles.DELIVERY_MAN:
             return error_response(message="Not authorized.", status_code=status.HTTP_403_FORBIDDEN)
 
-        orders = Order.objects.filter(delivery_man=request.user)
-        serializer = self.get_serializer(orders, many=True)
-        return success_response(data=serializer.data, message="Assigned orders retrieved successfully", status_code=status.HTTP_200_OK)
+        orders = Order.objects.with_related().filter(delivery_man=request.user)
+        page = self.paginate_queryset(orders)
+        serializer = self.get_serializer(page, many=True)
+        data = self.paginator.get_paginated_data(serializer.data)
+        return success_response(data=data, message="Assigned orders retrieved successfully", status_code=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='assigned/route')
+    def route(self, request):
+        """
+        Suggested stop sequence for the delivery man's open orders.
+        URL: /api/v1/orders/assigned/route/
+        """
+        return success_response(data=courier_route(request.user), message="Route planned successfully")
+
+
+class CourierLocationView(APIView):
+    """
+    A delivery man's last known position and availability for dispatch.
+    URL: /api/v1/couriers/location/
+    """
+    permission_classes = [IsAuthenticated, IsDeliveryMan]
+
+    def get(self, request):
+        location = CourierLocation.objects.filter(courier=request.user).first()
+        if location is None:
+            return error_response(message="No location reported yet.", status_code=status.HTTP_404_NOT_FOUND)
+        return success_response(data=CourierLocationSerializer(location).data, message="Location retrieved successfully")
+
+    def put(self, request):
+        serializer = CourierLocationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        location, _ = CourierLocation.objects.update_or_create(
+            courier=request.user,
+            defaults={**data, 'geohash': geohash(data['lat'], data['lng'])},
+        )
+        return success_response(data=CourierLocationSerializer(location).data, message="Location updated successfully")
+
+
+class OrderAnalyticsView(APIView):
+    """
+    Order counts and revenue per day and per delivery man, read from the
+    pre-aggregated OrderStat rollups.
+    URL: /api/v1/analytics/orders/?start=YYYY-MM-DD&end=YYYY-MM-DD
+    """
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        start, end = default_range()
+        try:
+            start = date.fromisoformat(request.query_params.get('start', start.isoformat()))
+            end = date.fromisoformat(request.query_params.get('end', end.isoformat()))
+        except ValueError:
+            return error_response({"date": "Use YYYY-MM-DD."}, "Invalid date range", status.HTTP_400_BAD_REQUEST)
+        if start > end or (end - start).days >= MAX_DAYS:
+            return error_response(
+                {"date": f"start must not be after end, and the range at most {MAX_DAYS} days."},
+                "Invalid date range",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        return success_response(data=order_summary(start, end), message="Order analytics retrieved successfully")
 
 
 class PayOrderView(APIView):
     permission_classes = [IsAuthenticated]
+    # Clients poll GET until the intent is ready; keep that off the role budget
+    throttle_scope = 'payment'
 
+    @idempotent
     def post(self, request, order_id):
         try:
             order = Order.objects.get(id=order_id, user=request.user)
+        except Order.DoesNotExist:
+            return error_response(message="Order not found.", status_code=status.HTTP_404_NOT_FOUND)
 
-            if order.is_paid:
-                return error_response(message="Order already paid.", status_code=status.HTTP_400_BAD_REQUEST)
+        if order.is_paid:
+            return error_response(message="Order already paid.", status_code=status.HTTP_400_BAD_REQUEST)
 
-            amount = int(order.total_amount * 100)  # convert dollars to cents
-            if amount <= 0:
-                return error_response(message="Invalid order amount.", status_code=status.HTTP_400_BAD_REQUEST)
+        if not order.total_amount or int(order.total_amount * 100) <= 0:
+            return error_response(message="Invalid order amount.", status_code=status.HTTP_400_BAD_REQUEST)
 
-            # Reuse existing PaymentIntent if available
-            if order.stripe_payment_intent:
-                intent = stripe.PaymentIntent.retrieve(order.stripe_payment_intent)
-            else:
-                intent = stripe.PaymentIntent.create(
-                    amount=amount,
-                    currency='usd',
-                    metadata={'order_id': str(order.id)},
-                    automatic_payment_methods={'enabled': True},
-                )
-                order.stripe_payment_intent = intent.id
-                order.payment_method = 'stripe'
-                order.save()
-
-            return success_response(data={'client_secret': intent.client_secret}, message="Payment intent created successfully", status_code=status.HTTP_200_OK)
+        # Reuses the order's existing job, so repeated taps never queue twice
+        job = enqueue_payment_intent(order)
+        return self.job_response(job)
 
+    def get(self, request, order_id):
+        """Poll the payment job of an order for its client_secret."""
+        try:
+            order = Order.objects.get(id=order_id, user=request.user)
         except Order.DoesNotExist:
             return error_response(message="Order not found.", status_code=status.HTTP_404_NOT_FOUND)
 
-        except stripe.error.StripeError as e:
-            logger.error(f"Stripe error during payment intent retrieval/creation: {e}")
-            return error_response(message=str(e), status_code=status.HTTP_502_BAD_GATEWAY)
+        job = latest_payment_job(order)
+        if job is None:
+            return error_response(message="No payment started for this order.", status_code=status.HTTP_404_NOT_FOUND)
+        return self.job_response(job)
 
-        except Exception as e:
-            logger.error(f"Unexpected error in PayOrderView: {e}")
-            return error_response(message="Something went wrong.", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    def job_response(self, job):
+        data = PaymentJobSerializer(job).data
+        if job.status == PaymentJob.StatusChoices.SUCCEEDED:
+            return success_response(data=data, message="Payment intent created successfully", status_code=status.HTTP_200_OK)
+        if job.status == PaymentJob.StatusChoices.FAILED:
+            return error_response(data, message="Payment intent could not be created.", status_code=status.HTTP_502_BAD_GATEWAY)
+        return success_response(data=data, message="Payment intent is being created", status_code=status.HTTP_202_ACCEPTED)
+
+
+class StripeWebhookView(APIView):
+    """
+    Receives signed payment_intent.* events from Stripe.
+
+    Events are stored once per event id and applied to orders in a batch, so
+    clients learn about payments from is_paid instead of polling Stripe.
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    # Stripe retries and bursts on its own schedule; the signature gates it
+    throttle_classes = []
+
+    def post(self, request):
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.headers.get('Stripe-Signature', ''),
+                settings.STRIPE_WEBHOOK_SECRET,
+            )
+        except (ValueError, stripe.error.SignatureVerificationError) as e:
+            logger.error(f"Rejected Stripe webhook: {e}")
+            return error_response(message="Invalid webhook signature.", status_code=status.HTTP_400_BAD_REQUEST)
+
+        if record_stripe_event(event):
+            process_stripe_events()
+        return success_response(message="Event received", status_code=status.HTTP_200_OK)
+
+
+class OrderEventTokenView(APIView):
+    """
+    Issues a stream token: it expires after ORDER_EVENTS_TOKEN_SECONDS and
+    only opens the order event stream, so it is safe to put in its URL.
+    URL: /api/v1/orders/events/token/
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        token = StreamToken.for_access_token(request.auth)
+        data = {'token': str(token), 'expires_in': settings.ORDER_EVENTS_TOKEN_SECONDS}
+        return success_response(data=data, message="Stream token issued")
+
+
+# Seconds between keep-alive comments on an idle event stream
+EVENT_STREAM_KEEPALIVE = 15
+
+
+def stream_error(message, status_code):
+    return JsonResponse(
+        {"success": False, "statusCode": status_code, "message": message, "Data": {}}, status=status_code
+    )
+
+
+async def order_events(request):
+    """
+    Server-Sent Events stream of changes to the caller's orders.
+    URL: /api/v1/orders/events/
+
+    Needs an ASGI server; under WSGI each open stream would pin a worker, so
+    it answers 501. EventSource cannot send headers, so browsers pass a
+    stream token from OrderEventTokenView as ``?token=``; access tokens are
+    only accepted in the Authorization header, never in the URL.
+    """
+    if not isinstance(request, ASGIRequest):
+        return stream_error("The event stream needs an ASGI server.", status.HTTP_501_NOT_IMPLEMENTED)
+    problem = await sync_to_async(broker_problem)()
+    if problem:
+        logger.error(f"Order event stream disabled: {problem}")
+        return stream_error("The event stream is not available.", status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    if 'token' in request.GET:
+        raw_token, validate = request.GET['token'], StreamToken.validate
+    else:
+        header = request.headers.get('Authorization', '').split()
+        raw_token = header[1] if len(header) == 2 and header[0] in jwt_settings.AUTH_HEADER_TYPES else None
+        validate = StatelessJWTAuthentication().get_validated_token
+    try:
+        if not raw_token:
+            raise InvalidToken()
+        # Signature, expiry and revocation only: the stream never needs the User row
+        token = await sync_to_async(validate)(raw_token)
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return stream_error("Invalid or missing token", status.HTTP_401_UNAUTHORIZED)
+
+    async def stream():
+        subscription = get_broker().subscribe(user_channel(user_id))
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    message = await subscription.get(timeout=EVENT_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: order\ndata: {message}\n\n"
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
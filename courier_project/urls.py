@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from courier_app.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('courier_app.urls')),  # Auth endpoints
+    path('metrics', metrics_view, name='metrics'),
 ]